@@ -0,0 +1,279 @@
+"""Benchmarks of the hot paths of shooter.
+
+Each benchmark is timed with timeit (the best of several repeats) and the
+results are printed as JSON (nanoseconds per operation and operations per
+second). The ping pong benchmarks run a scenario where two threads exchange
+messages over local sockets and report messages per second.
+
+    python benchmarks/hot_paths.py --output before.json
+    python benchmarks/hot_paths.py --output after.json
+    python benchmarks/hot_paths.py --compare before.json after.json
+
+With a single file --compare runs the benchmarks and compares them with the
+file. The exit code is 1 if a benchmark got slower by more than
+--threshold percent.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+import timeit
+
+import orwell.yaml2protobuf as y2p
+import orwell.shooter.loading as loading
+import orwell.shooter.scenario as scen
+
+# bump when the benchmarks change so that old results are not compared
+FORMAT = 1
+
+STANDALONE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "Standalone.yml")
+
+TEMPLATES = """
+hello: !CaptureHello
+    destination: TEST1
+    message:
+        name: "{player_name}"
+        ready: True
+        address: "{address}"
+"""
+
+ARGUMENTS = {"player_name": "Player", "address": "3.4.5.6"}
+
+PING_PONG = """
+messages:
+    - hello: !CaptureHello &hello
+        destination: TEST1
+        message:
+            name: "{{player_name}}"
+    - welcome: !CaptureWelcome &welcome
+        destination: "{{id}}"
+        message:
+            robot: Nono
+            team: One
+            id: "{{id}}"
+            video_address: "http://fake.com"
+            video_port: 42
+
+sockets:
+    - !SocketPush &push_one
+        port: {port_one}
+        bind: yes
+    - !SocketPull &pull_one
+        port: {port_two}
+        bind: yes
+    - !SocketPush &push_two
+        port: {port_two}
+    - !SocketPull &pull_two
+        port: {port_one}
+
+threads:
+    - !Thread
+        name: "ping"
+        loop: False
+        retention: referenced
+        in_socket: *pull_one
+        out_socket: *push_one
+        flow:
+{ping_flow}
+    - !Thread
+        name: "pong"
+        loop: False
+        retention: referenced
+        in_socket: *pull_two
+        out_socket: *push_two
+        flow:
+{pong_flow}
+"""
+
+PING_STEPS = """\
+            - !Out
+                message: *hello
+                arguments:
+                    player_name: "Player"
+            - !In
+                message: *welcome
+"""
+
+PONG_STEPS = """\
+            - !In
+                message: *hello
+            - !Out
+                message: *welcome
+                arguments:
+                    id: "{Hello[-1].player_name}"
+"""
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def micro_benchmarks():
+    """Functions to time by name."""
+    hello = loading.load(TEMPLATES)["hello"]
+    frame = hello.encode_zmq_message(ARGUMENTS)
+    received = y2p.Capture.create_from_zmq(frame)
+    _, _, payload = y2p.split_header(frame)
+    base = y2p.Hello(bytes(payload), "TEST1")
+    # what In does with a message received
+    hello.compute_differences(received)
+    hello.raw = received._pb_message
+    repository = scen.CaptureRepository()
+    repository.add_received_message(hello)
+    expression = "{Hello[-1].player_name}"
+    repository.compile(expression)
+    with open(STANDALONE) as standalone:
+        yaml_content = standalone.read()
+
+    def key_map():
+        base.__dict__.pop("_key_map", None)
+        return base.key_map
+
+    return {
+        "create_from_zmq": lambda: y2p.Capture.create_from_zmq(frame),
+        "compute_differences": lambda: hello.compute_differences(received),
+        "fill": lambda: hello.fill(ARGUMENTS),
+        "encode_zmq_message": lambda: hello.encode_zmq_message(ARGUMENTS),
+        "key_map": key_map,
+        "expand": lambda: repository.expand(expression),
+        "yaml_loading": lambda: loading.load(yaml_content),
+    }
+
+
+def time_function(function, repeat):
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {
+        "ns_per_op": best * 1e9,
+        "ops_per_second": 1 / best,
+    }
+
+
+def ping_pong(count, scheduler, repeat):
+    """Messages per second when two threads exchange count messages each
+    (the best of repeat runs)."""
+    elapsed = None
+    for _ in range(repeat):
+        content = PING_PONG.format(
+            port_one=_free_port(),
+            port_two=_free_port(),
+            ping_flow=PING_STEPS * count,
+            pong_flow=PONG_STEPS * count)
+        with scen.Scenario(content, scheduler=scheduler) as scenario:
+            scenario.build()
+            start = time.perf_counter()
+            scenario.step_all()
+            duration = time.perf_counter() - start
+        if (elapsed is None) or (duration < elapsed):
+            elapsed = duration
+    return {
+        "messages": 2 * count,
+        "seconds": elapsed,
+        "messages_per_second": 2 * count / elapsed,
+        "ns_per_op": elapsed * 1e9 / (2 * count),
+    }
+
+
+def run(repeat, messages, selected=None):
+    results = {}
+    for name, function in sorted(micro_benchmarks().items()):
+        if (selected) and (name not in selected):
+            continue
+        results[name] = time_function(function, repeat)
+    for scheduler in ("events", "asyncio"):
+        name = "ping_pong_" + scheduler
+        if (selected) and (name not in selected):
+            continue
+        results[name] = ping_pong(messages, scheduler, repeat)
+    return {
+        "format": FORMAT,
+        "python": sys.version.split()[0],
+        "benchmarks": results,
+    }
+
+
+def compare(old, new, threshold):
+    """Lines comparing two results and whether a benchmark regressed."""
+    if (old.get("format") != new.get("format")):
+        raise Exception("The results come from different benchmarks.")
+    lines = ["{:<22} {:>14} {:>14} {:>8}".format(
+        "benchmark", "old (ns/op)", "new (ns/op)", "change")]
+    regressed = False
+    for name in sorted(set(old["benchmarks"]) & set(new["benchmarks"])):
+        before = old["benchmarks"][name]["ns_per_op"]
+        after = new["benchmarks"][name]["ns_per_op"]
+        change = (after - before) * 100 / before
+        flag = ""
+        if (change > threshold):
+            flag = " slower"
+            regressed = True
+        lines.append("{:<22} {:>14.1f} {:>14.1f} {:>+7.1f}%{}".format(
+            name, before, after, change, flag))
+    return lines, regressed
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Hot paths benchmark.')
+    parser.add_argument(
+        'benchmarks',
+        help='Benchmarks to run (all of them by default).',
+        nargs="*")
+    parser.add_argument(
+        '--repeat', '-r',
+        help='Number of measures kept for each benchmark (the best one).',
+        default=5,
+        type=int)
+    parser.add_argument(
+        '--messages', '-m',
+        help='Messages sent by each thread in the ping pong benchmarks.',
+        default=2000,
+        type=int)
+    parser.add_argument(
+        '--output', '-o',
+        help='File where the results are written (JSON).',
+        default=None)
+    parser.add_argument(
+        '--compare', '-c',
+        help='Results to compare: OLD (with a new run) or OLD NEW.',
+        nargs="+",
+        metavar="FILE")
+    parser.add_argument(
+        '--threshold', '-t',
+        help='Slowdown in percent reported as a regression.',
+        default=10,
+        type=float)
+    arguments = parser.parse_args(argv)
+    if (arguments.compare) and (len(arguments.compare) > 2):
+        parser.error("--compare takes one or two files")
+    if (arguments.compare) and (2 == len(arguments.compare)):
+        with open(arguments.compare[1]) as new_file:
+            results = json.load(new_file)
+    else:
+        results = run(
+            arguments.repeat, arguments.messages, arguments.benchmarks)
+        text = json.dumps(results, indent=4, sort_keys=True)
+        if (arguments.output):
+            with open(arguments.output, "w") as output:
+                output.write(text + "\n")
+        else:
+            print(text)
+    if (arguments.compare):
+        with open(arguments.compare[0]) as old_file:
+            old = json.load(old_file)
+        lines, regressed = compare(old, results, arguments.threshold)
+        for line in lines:
+            print(line)
+        if (regressed):
+            return 1
+    return 0
+
+
+if "__main__" == __name__:
+    sys.exit(main(sys.argv[1:]))
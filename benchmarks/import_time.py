@@ -0,0 +1,57 @@
+"""Time needed to import the modules of shooter.
+
+Each measure is done in a new interpreter so that nothing is already
+imported. The result is printed as JSON (times in milliseconds).
+
+    python benchmarks/import_time.py --runs 20 orwell.yaml2protobuf
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+MEASURE = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def measure(module, runs):
+    durations = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, "-c", MEASURE.format(module=module)])
+        durations.append(float(output.decode("utf8").split()[-1]) * 1000)
+    return {
+        "module": module,
+        "runs": runs,
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "max": max(durations),
+    }
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Import time benchmark.')
+    parser.add_argument(
+        'modules',
+        help='Modules to import.',
+        nargs="*",
+        default=["orwell.yaml2protobuf", "orwell.shooter.scenario"])
+    parser.add_argument(
+        '--runs', '-r',
+        help='Number of imports measured for each module.',
+        default=10,
+        type=int)
+    arguments = parser.parse_args(argv)
+    results = [measure(module, arguments.runs)
+               for module in arguments.modules]
+    print(json.dumps(results, indent=4))
+
+
+if "__main__" == __name__:
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,278 @@
+"""Run many scenario files in parallel.
+
+The files are spread over worker processes that each run one scenario at
+a time (so the interpreter and the modules are loaded once per worker, not
+once per file). The ports bound by a scenario are replaced by free ports
+before it runs, so that scenarios written for the same fixed ports (like
+9000 and 9001 in the examples) do not collide; the ports that are only
+connected to (a server outside of the scenario) are left alone.
+
+A scenario running for longer than the timeout is stopped (its worker is
+replaced) and reported as timed out.
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import socket
+import time
+
+from . import loading
+
+PASSED = "passed"
+FAILED = "failed"
+TIMEOUT = "timeout"
+
+SUFFIXES = (".yml", ".yaml")
+
+PORT_LINE = re.compile(r"^(\s*port:\s*)(\d+)(\s*)$", re.MULTILINE)
+
+
+def scenario_files(paths):
+    """The files in paths, directories replaced by the scenario files they
+    contain (sorted), each file once."""
+    files = []
+    for path in paths:
+        if (os.path.isdir(path)):
+            files.extend(sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if (name.endswith(SUFFIXES))))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def bound_ports(yaml_content, cache_dir=None):
+    """TCP ports the sockets of a scenario bind."""
+    data = loading.load(yaml_content, cache_dir)
+    sockets = list(data.get("sockets") or [])
+    for thread in data.get("threads") or []:
+        sockets.extend((thread.in_socket, thread.out_socket))
+    return {
+        getattr(yaml_socket, "port", None)
+        for yaml_socket in sockets
+        if ((getattr(yaml_socket, "bind", False)) and
+            ("tcp" == getattr(yaml_socket, "protocol", "tcp")))} - {None}
+
+
+def remap_ports(yaml_content, cache_dir=None):
+    """Replace the ports bound by the scenario by free ports.
+
+    Return the new content and the dictionary from old to new port.
+    """
+    ports = {
+        port: free_port() for port in bound_ports(yaml_content, cache_dir)}
+
+    def replace(match):
+        port = int(match.group(2))
+        if (port not in ports):
+            return match.group(0)
+        return "{}{}{}".format(match.group(1), ports[port], match.group(3))
+
+    return PORT_LINE.sub(replace, yaml_content), ports
+
+
+def run_file(path, scheduler="polling", cache_dir=None):
+    """Run a scenario file (with its ports remapped) and return its
+    report."""
+    import orwell.shooter.scenario as scen
+    report = {
+        "file": path, "status": PASSED, "error": None, "seconds": None,
+        "ports": {}}
+    start = time.monotonic()
+    try:
+        with open(path) as scenario_file:
+            yaml_content = scenario_file.read()
+        yaml_content, ports = remap_ports(yaml_content, cache_dir)
+        report["ports"] = ports
+        with scen.Scenario(
+                yaml_content,
+                scheduler=scheduler,
+                cache_dir=cache_dir) as scenario:
+            scenario.build()
+            scenario.step_all()
+    except Exception as exception:
+        report["status"] = FAILED
+        report["error"] = str(exception)
+    report["seconds"] = time.monotonic() - start
+    return report
+
+
+def _work(number, tasks, results, scheduler, cache_dir, verbose):
+    """Entry point of a worker process."""
+    from . import log
+    if (verbose is not None):
+        import orwell.shooter.scenario as scen
+        scen.configure_logging(verbose)
+    while (True):
+        path = tasks.get()
+        if (path is None):
+            break
+        results.put(("start", number, path))
+        results.put(("done", number, run_file(path, scheduler, cache_dir)))
+    log.stop()
+
+
+class BatchRunner(object):
+    """Runs scenario files in `jobs` worker processes."""
+
+    # seconds to wait for a report before checking the timeouts
+    wait_timeout = 0.1
+
+    def __init__(
+            self,
+            paths,
+            jobs=None,
+            timeout=60,
+            scheduler="polling",
+            cache_dir=None,
+            verbose=None):
+        """
+        `paths` are scenario files or directories containing some.
+        `jobs` is the number of worker processes (the number of CPUs by
+        default).
+        `timeout` is the number of seconds a scenario may run for (None
+        means forever).
+        `verbose` is passed to configure_logging in the workers (None means
+        the workers do not log).
+        """
+        self._files = scenario_files(paths)
+        self._jobs = max(
+            1, min(jobs or os.cpu_count() or 1, len(self._files)))
+        self._timeout = timeout
+        self._scheduler = scheduler
+        self._cache_dir = cache_dir
+        self._verbose = verbose
+        # spawn as forking a process using zmq is not safe
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks = None
+        self._results = None
+        # worker number -> process (a replaced worker gets a new number)
+        self._workers = {}
+        self._next_number = 0
+        # worker number -> (path, start) of the scenario it runs
+        self._running = {}
+
+    @property
+    def files(self):
+        return self._files
+
+    def run(self):
+        """Run all the files and return their reports (in the order of the
+        files)."""
+        logger = logging.getLogger(__name__)
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        for path in self._files:
+            self._tasks.put(path)
+        reports = {}
+        try:
+            for _ in range(self._jobs):
+                self._start_worker()
+            while (len(reports) < len(self._files)):
+                try:
+                    event, number, value = self._results.get(
+                        timeout=self.wait_timeout)
+                except queue.Empty:
+                    event = None
+                if (event is None):
+                    pass
+                elif (number not in self._workers):
+                    # the worker was stopped after picking another file
+                    if ("start" == event) and (value not in reports):
+                        self._tasks.put(value)
+                elif ("start" == event):
+                    self._running[number] = (value, time.monotonic())
+                else:
+                    self._running.pop(number, None)
+                    reports[value["file"]] = value
+                    logger.info(
+                        "%s %s (%.2f s)",
+                        value["status"], value["file"], value["seconds"])
+                for report in self._check_workers():
+                    reports[report["file"]] = report
+        finally:
+            self._stop()
+        return [reports[path] for path in self._files]
+
+    def _start_worker(self):
+        number = self._next_number
+        self._next_number += 1
+        process = self._context.Process(
+            target=_work,
+            args=(number, self._tasks, self._results, self._scheduler,
+                  self._cache_dir, self._verbose),
+            name="batch-{}".format(number))
+        process.start()
+        self._workers[number] = process
+
+    def _check_workers(self):
+        """Reports of the scenarios whose worker timed out or died (the
+        worker is replaced)."""
+        reports = []
+        now = time.monotonic()
+        for number, process in list(self._workers.items()):
+            path, start = self._running.get(number, (None, None))
+            if (path is None):
+                if (process.exitcode not in (None, 0)):
+                    del self._workers[number]
+                    self._start_worker()
+                continue
+            if ((self._timeout is not None) and
+                    (now - start > self._timeout)):
+                status = TIMEOUT
+                error = "Timeout after {} seconds.".format(self._timeout)
+            elif (process.exitcode is not None):
+                status = FAILED
+                error = "Process '{}' exited with code {}.".format(
+                    process.name, process.exitcode)
+            else:
+                continue
+            if (process.is_alive()):
+                process.terminate()
+            process.join()
+            del self._workers[number]
+            del self._running[number]
+            reports.append({
+                "file": path, "status": status, "error": error,
+                "seconds": now - start, "ports": {}})
+            self._start_worker()
+        return reports
+
+    def _stop(self):
+        for _ in self._workers:
+            self._tasks.put(None)
+        for process in self._workers.values():
+            process.join(self.wait_timeout * 10)
+            if (process.is_alive()):
+                process.terminate()
+                process.join()
+        self._workers.clear()
+        self._running.clear()
+
+
+def format_report(reports, seconds):
+    """Lines describing the result of each scenario and the totals (the
+    batch took `seconds`)."""
+    lines = []
+    counts = {PASSED: 0, FAILED: 0, TIMEOUT: 0}
+    for report in reports:
+        counts[report["status"]] += 1
+        line = "{:<8} {:>8.2f} s  {}".format(
+            report["status"], report["seconds"], report["file"])
+        if (report["error"]):
+            line += ": " + report["error"]
+        lines.append(line)
+    lines.append(
+        "{} passed, {} failed, {} timed out in {:.2f} s".format(
+            counts[PASSED], counts[FAILED], counts[TIMEOUT], seconds))
+    return lines
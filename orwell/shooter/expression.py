@@ -0,0 +1,220 @@
+"""Expressions found in scenario files (like "{Registered[-1].true_id}").
+
+The expressions are parsed and compiled once. Only names, attribute access,
+indexing (and slicing), constants and calls to the functions of FUNCTIONS
+are allowed which makes the evaluation safe (no builtins are available).
+"""
+
+import ast
+import re
+
+# same syntax as str.format placeholders: "{{" is not an expression
+EVAL_REGEXP = re.compile(r'\{[^{].*[^}]\}')
+
+FUNCTIONS = {
+    "abs": abs,
+    "bool": bool,
+    "float": float,
+    "int": int,
+    "len": len,
+    "max": max,
+    "min": min,
+    "round": round,
+    "sorted": sorted,
+    "str": str,
+    "sum": sum,
+}
+
+# names of the ast nodes allowed (some of them only exist in some versions
+# of Python)
+_ALLOWED_NODES = frozenset((
+    "Expression",
+    "Name",
+    "Load",
+    "Attribute",
+    "Subscript",
+    "Index",
+    "Slice",
+    "Constant",
+    "Num",
+    "Str",
+    "Bytes",
+    "NameConstant",
+    "UnaryOp",
+    "UAdd",
+    "USub",
+    "Call",
+))
+
+
+class Literal(object):
+    """Value that is not an expression (evaluated as itself)."""
+
+    __slots__ = ("value",)
+    names = ()
+    indices = {}
+    attributes = {}
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, namespace):
+        return self.value
+
+    def __repr__(self):
+        return "{Literal | %s}" % repr(self.value)
+
+
+def _constant_index(node):
+    """Value of an index if it is a constant integer (None otherwise)."""
+    if ("Index" == type(node).__name__):
+        node = node.value
+    sign = 1
+    if (isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub)):
+        sign = -1
+        node = node.operand
+    if (type(node).__name__ not in ("Constant", "Num")):
+        return None
+    value = getattr(node, "value", getattr(node, "n", None))
+    if ((not isinstance(value, int)) or isinstance(value, bool)):
+        return None
+    return sign * value
+
+
+def _indices(tree):
+    """Indices used for each name (None if it is used in another way, so
+    that the whole sequence may be needed).
+
+    "{Hello[-1].name}" gives {"Hello": {-1}} and "{len(Hello)}" gives
+    {"Hello": set()} as only the length is needed.
+    """
+    indices = {}
+    handled = set()
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Subscript) and
+                isinstance(node.value, ast.Name)):
+            index = _constant_index(node.slice)
+            if (index is not None):
+                handled.add(id(node.value))
+                known = indices.setdefault(node.value.id, set())
+                if (known is not None):
+                    known.add(index)
+        elif (isinstance(node, ast.Call)):
+            handled.add(id(node.func))
+            if (("len" == node.func.id) and (1 == len(node.args)) and
+                    isinstance(node.args[0], ast.Name)):
+                handled.add(id(node.args[0]))
+                indices.setdefault(node.args[0].id, set())
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Name) and (id(node) not in handled)):
+            indices[node.id] = None
+    return indices
+
+
+def _attributes(tree):
+    """Attributes read on the items of each name (None if the items are
+    used in another way, so that all their attributes may be needed).
+
+    "{Hello[-1].name}" gives {"Hello": {"name"}}.
+    """
+    parents = {}
+    for node in ast.walk(tree):
+        for child in ast.iter_child_nodes(node):
+            parents[id(child)] = node
+    attributes = {}
+    for node in ast.walk(tree):
+        if (not isinstance(node, ast.Name)):
+            continue
+        parent = parents.get(id(node))
+        if (isinstance(parent, ast.Call)):
+            if ((parent.func is node) or ("len" == parent.func.id)):
+                # a function or the length of a sequence
+                continue
+        known = attributes.setdefault(node.id, set())
+        if (known is None):
+            continue
+        grand_parent = parents.get(id(parent))
+        if (isinstance(parent, ast.Subscript) and (parent.value is node) and
+                isinstance(grand_parent, ast.Attribute)):
+            known.add(grand_parent.attr)
+        else:
+            attributes[node.id] = None
+    return attributes
+
+
+class Expression(object):
+    """Expression compiled once and evaluated as a string."""
+
+    __slots__ = ("text", "names", "indices", "attributes", "_code")
+
+    def __init__(self, text):
+        self.text = text
+        try:
+            tree = ast.parse(text[1:-1].strip(), mode="eval")
+        except SyntaxError as error:
+            raise Exception(
+                "Invalid expression '{}': {}.".format(text, error.msg))
+        self.names = Expression._check(tree, text)
+        self.indices = _indices(tree)
+        self.attributes = _attributes(tree)
+        self._code = compile(tree, text, "eval")
+
+    @staticmethod
+    def _check(tree, text):
+        """Reject what is not allowed and return the names used."""
+        names = set()
+        for node in ast.walk(tree):
+            kind = type(node).__name__
+            if (kind not in _ALLOWED_NODES):
+                raise Exception(
+                    "Forbidden {} in expression '{}'.".format(kind, text))
+            if (isinstance(node, ast.Name)):
+                if (node.id.startswith("_")):
+                    raise Exception(
+                        "Forbidden name '{}' in expression '{}'.".format(
+                            node.id, text))
+                names.add(node.id)
+            elif (isinstance(node, ast.Attribute)):
+                if (node.attr.startswith("_")):
+                    raise Exception(
+                        "Forbidden attribute '{}' in expression '{}'.".format(
+                            node.attr, text))
+            elif (isinstance(node, ast.Call)):
+                if ((not isinstance(node.func, ast.Name)) or
+                        (node.func.id not in FUNCTIONS) or
+                        (node.keywords)):
+                    raise Exception(
+                        "Forbidden call in expression '{}' (available "
+                        "functions: {}).".format(
+                            text, ", ".join(sorted(FUNCTIONS))))
+        return frozenset(names)
+
+    def evaluate(self, namespace):
+        """Value of the expression as a string.
+
+        namespace must map "__builtins__" to an empty dictionary (see
+        CaptureRepository).
+        """
+        return str(eval(self._code, namespace))
+
+    def __repr__(self):
+        return "{Expression | %s}" % self.text
+
+
+# expressions already compiled (the same text is often used by many steps
+# and replicas)
+_CACHE = {}
+
+
+def parse(value):
+    """Literal or Expression for a value found in a scenario file."""
+    if (not isinstance(value, str)):
+        return Literal(value)
+    compiled = _CACHE.get(value)
+    if (compiled is None):
+        if (EVAL_REGEXP.match(value)):
+            compiled = Expression(value)
+        else:
+            compiled = Literal(value)
+        _CACHE[value] = compiled
+    return compiled
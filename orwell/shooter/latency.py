@@ -0,0 +1,162 @@
+import collections
+import time
+
+
+class Histogram(object):
+    """Histogram of durations in nanoseconds (HDR style).
+
+    Each power of two is split in 2 ** PRECISION_BITS buckets of equal
+    width so the relative error on a value is below 1 / 2 ** PRECISION_BITS
+    whatever its magnitude. Buckets are stored sparsely by lower bound which
+    makes histograms cheap to merge.
+    """
+
+    PRECISION_BITS = 5
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def _bucket(value):
+        shift = max(0, value.bit_length() - Histogram.PRECISION_BITS - 1)
+        return (value >> shift) << shift, (1 << shift) - 1
+
+    def record(self, value):
+        lower, _ = Histogram._bucket(value)
+        self.counts[lower] += 1
+        self.count += 1
+        self.total += value
+        if (self.min is None) or (value < self.min):
+            self.min = value
+        if (self.max is None) or (value > self.max):
+            self.max = value
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if (value is not None):
+                if (self.min is None) or (value < self.min):
+                    self.min = value
+                if (self.max is None) or (value > self.max):
+                    self.max = value
+
+    def percentile(self, percent):
+        """Highest value equivalent to the given percentile (None if
+        empty)."""
+        if (not self.count):
+            return None
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for lower in sorted(self.counts):
+            seen += self.counts[lower]
+            if (seen >= threshold):
+                _, width = Histogram._bucket(lower)
+                return min(lower + width, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "min": self.min,
+            "mean": (self.total / self.count) if self.count else None,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class LatencyRecorder(object):
+    """Collects the latencies between a sent message and the next matching
+    received message, per thread and per pair of message types.
+
+    The samples received during the first `warmup` seconds are ignored.
+    """
+
+    def __init__(self, warmup=0):
+        self._not_before = time.monotonic_ns() + int(warmup * 1e9)
+        self.by_thread = collections.defaultdict(Histogram)
+        self.by_message = collections.defaultdict(Histogram)
+
+    def record(self, thread_name, exchange, sent, received):
+        if (received < self._not_before):
+            return
+        latency = received - sent
+        self.by_thread[thread_name].record(latency)
+        self.by_message[exchange].record(latency)
+
+    def merge(self, other):
+        for name, histogram in other.by_thread.items():
+            self.by_thread[name].merge(histogram)
+        for exchange, histogram in other.by_message.items():
+            self.by_message[exchange].merge(histogram)
+
+    def report(self):
+        """Summaries (in nanoseconds) keyed by thread and message types."""
+        return {
+            "threads": {name: histogram.summary()
+                        for name, histogram in self.by_thread.items()},
+            "messages": {exchange: histogram.summary()
+                         for exchange, histogram in self.by_message.items()},
+        }
+
+    def format_report(self):
+        """Human readable report as a list of lines (in milliseconds)."""
+        columns = ("count", "p50", "p90", "p99", "max")
+        rows = [("thread " + name, histogram)
+                for name, histogram in sorted(self.by_thread.items())]
+        rows += sorted(self.by_message.items())
+        width = max([len("latency (ms)")] + [len(name) for name, _ in rows])
+        lines = ["{:<{}} {}".format(
+            "latency (ms)", width,
+            " ".join("{:>9}".format(column) for column in columns))]
+        for name, histogram in rows:
+            summary = histogram.summary()
+            values = ["{:>9}".format(summary["count"])]
+            for column in columns[1:]:
+                values.append("{:>9.3f}".format(summary[column] / 1e6))
+            lines.append("{:<{}} {}".format(name, width, " ".join(values)))
+        return lines
+
+
+class ThreadLatency(object):
+    """Timestamps the messages sent and received by one thread.
+
+    A received message is matched with the last message sent by the thread
+    (each sent message is matched at most once).
+    """
+
+    def __init__(self, thread_name, recorder=None):
+        self._thread_name = thread_name
+        self._recorder = recorder
+        self.last_sent = None
+        self._last_sent_type = None
+
+    @property
+    def recorder(self):
+        """LatencyRecorder the latencies are recorded to (if any)."""
+        return self._recorder
+
+    def sent(self, message_type):
+        self.last_sent = time.monotonic_ns()
+        self._last_sent_type = message_type
+
+    def received(self, message_type):
+        now = time.monotonic_ns()
+        if (self.last_sent is None):
+            return None
+        latency = now - self.last_sent
+        if (self._recorder is not None):
+            self._recorder.record(
+                self._thread_name,
+                self._last_sent_type + "->" + message_type,
+                self.last_sent,
+                now)
+        self.last_sent = None
+        return latency
@@ -0,0 +1,109 @@
+"""Loading of scenario files.
+
+The YAML is parsed with libyaml when PyYAML was built with it. The objects
+loaded can also be cached (pickled in a directory) so that the same
+scenario is only parsed once. Only the parsing is skipped: the message
+classes are still resolved and the templates compiled when the scenario is
+built.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+import yaml
+
+from .. import yaml2protobuf
+
+# to be changed when what is pickled changes
+CACHE_FORMAT = 1
+
+# modules defining the classes of the pickled objects (relative to the
+# orwell package)
+CLASS_MODULES = ("yaml2protobuf.py", "shooter/scenario.py")
+
+# digest of CLASS_MODULES (computed once)
+_modules_digest = None
+
+if (yaml.__with_libyaml__):
+    class ScenarioLoader(yaml.cyaml.CParser, yaml.FullLoader):
+        """FullLoader with the parser of libyaml.
+
+        yaml.CFullLoader cannot be used as the YAMLObject classes register
+        their tags on yaml.FullLoader.
+        """
+
+        def __init__(self, stream):
+            yaml.cyaml.CParser.__init__(self, stream)
+            yaml.constructor.FullConstructor.__init__(self)
+            yaml.resolver.Resolver.__init__(self)
+else:
+    ScenarioLoader = yaml.FullLoader
+
+
+def _classes_digest():
+    """Digest of the content of the modules defining the pickled classes."""
+    global _modules_digest
+    if (_modules_digest is None):
+        digest = hashlib.sha256()
+        package = os.path.dirname(yaml2protobuf.__file__)
+        for module in CLASS_MODULES:
+            with open(os.path.join(package, module), "rb") as module_file:
+                digest.update(module_file.read())
+        _modules_digest = digest.hexdigest()
+    return _modules_digest
+
+
+def _cache_key(yaml_content):
+    digest = hashlib.sha256()
+    digest.update(str(CACHE_FORMAT).encode("utf8"))
+    # the pickled objects depend on the classes
+    digest.update(_classes_digest().encode("utf8"))
+    digest.update(yaml_content.encode("utf8"))
+    return digest.hexdigest()
+
+
+def _read_cache(path):
+    logger = logging.getLogger(__name__)
+    try:
+        with open(path, "rb") as cache_file:
+            data = pickle.load(cache_file)
+        logger.debug("Scenario read from cache '%s'.", path)
+        return data
+    except FileNotFoundError:
+        pass
+    except Exception as exception:
+        logger.warning("Ignore cache '%s': %s", path, exception)
+    return None
+
+
+def _write_cache(path, data):
+    logger = logging.getLogger(__name__)
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, "wb") as cache_file:
+            pickle.dump(data, cache_file, pickle.HIGHEST_PROTOCOL)
+        # other processes never see a partial file
+        os.replace(temporary_path, path)
+    except Exception as exception:
+        logger.warning("Could not write cache '%s': %s", path, exception)
+
+
+def load(yaml_content, cache_dir=None):
+    """Objects described by a scenario file.
+
+    If cache_dir is given the result is cached there, keyed by the content
+    of the file.
+    """
+    if (cache_dir is None):
+        return yaml.load(yaml_content, Loader=ScenarioLoader)
+    path = os.path.join(cache_dir, _cache_key(yaml_content) + ".pickle")
+    data = _read_cache(path)
+    if (data is None):
+        data = yaml.load(yaml_content, Loader=ScenarioLoader)
+        _write_cache(path, data)
+    return data
@@ -0,0 +1,91 @@
+"""Logging with little overhead on the threads of a scenario.
+
+The name of the thread being stepped is kept in a context variable (so each
+asyncio task has its own) and added to the messages by ThreadLoggerAdapter
+only when a record is actually emitted. The records can be sent through a
+queue to a background thread that formats and writes them.
+"""
+
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import queue
+
+# prefix of the messages logged for the current thread (like "robot | ")
+_THREAD_PREFIX = contextvars.ContextVar("thread_prefix", default="")
+
+FORMAT = '%(asctime)s %(name)-12s %(lineno)4d %(levelname)-8s %(message)s'
+
+# handler added by configure and the loggers it was added to
+_handler = None
+_loggers = []
+# background thread writing the queued records (see configure)
+_listener = None
+
+
+def set_thread_prefix(prefix):
+    _THREAD_PREFIX.set(prefix)
+
+
+class ThreadLoggerAdapter(logging.LoggerAdapter):
+    """Prefixes the messages with the name of the current thread."""
+
+    def __init__(self, logger):
+        super(ThreadLoggerAdapter, self).__init__(logger, {})
+
+    def process(self, msg, kwargs):
+        # only called for the records that are emitted
+        return _THREAD_PREFIX.get() + str(msg), kwargs
+
+
+def get_logger(name):
+    return ThreadLoggerAdapter(logging.getLogger(name))
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler leaving the formatting to the listener.
+
+    The arguments of the records are formatted in the background thread so
+    they must not be modified once logged.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure(loggers, verbose, asynchronous=True, stream=None):
+    """Make the loggers write to stream (stderr by default).
+
+    With asynchronous the records are only queued by the threads logging
+    them and a background thread writes them (see stop).
+    """
+    global _handler, _listener
+    if (_handler is None):
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(FORMAT))
+        if (asynchronous):
+            records = queue.SimpleQueue()
+            _listener = logging.handlers.QueueListener(records, handler)
+            _listener.start()
+            atexit.register(stop)
+            handler = _QueueHandler(records)
+        _handler = handler
+    for logger in loggers:
+        if (_handler not in logger.handlers):
+            logger.addHandler(_handler)
+            _loggers.append(logger)
+        logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    return _handler
+
+
+def stop():
+    """Write the records still queued and remove the handler."""
+    global _handler, _listener
+    if (_listener is not None):
+        _listener.stop()
+        _listener = None
+    for logger in _loggers:
+        logger.removeHandler(_handler)
+    del _loggers[:]
+    _handler = None
@@ -1,14 +1,20 @@
 import logging
 import sys
 import argparse
+import json
 import time
 
+import orwell.shooter.batch as batch
+import orwell.shooter.recording as recording
 import orwell.shooter.scenario as scen
 
 
 def main(argv=sys.argv[1:]):
     parser = argparse.ArgumentParser(description='Scenario shooter.')
-    parser.add_argument('scenario_file', help='YAML scenario file.')
+    parser.add_argument(
+        'scenario_file',
+        help='YAML scenario file (not needed with --replay or --batch).',
+        nargs='?')
     parser.add_argument(
         '--delay', '-d',
         help='Delay between steps.',
@@ -16,12 +22,113 @@ def main(argv=sys.argv[1:]):
         action="store",
         metavar="DELAY",
         type=int)
+    parser.add_argument(
+        '--scheduler', '-s',
+        help='How threads are scheduled: "polling" visits every thread '
+             'in turn, "events" only steps threads that can progress, '
+             '"asyncio" runs each thread as a coroutine.',
+        default="polling",
+        choices=scen.Scenario.SCHEDULERS)
+    parser.add_argument(
+        '--processes', '-p',
+        help='Number of processes the threads are spread over.',
+        default=1,
+        action="store",
+        metavar="PROCESSES",
+        type=int)
+    parser.add_argument(
+        '--io-threads',
+        help='Number of I/O threads of the zmq context (overrides the '
+             'io_threads of the scenario file).',
+        default=None,
+        action="store",
+        metavar="THREADS",
+        type=int)
+    parser.add_argument(
+        '--latency', '-l',
+        help='Report the latencies between sent and received messages.',
+        default=False,
+        action="store_true")
+    parser.add_argument(
+        '--warmup', '-w',
+        help='Seconds at the beginning when latencies are not recorded.',
+        default=0,
+        action="store",
+        metavar="WARMUP",
+        type=float)
+    parser.add_argument(
+        '--cache-dir',
+        help='Directory where parsed scenario files are cached.',
+        default=None,
+        action="store",
+        metavar="CACHE_DIR")
+    parser.add_argument(
+        '--profile',
+        help='Write the time spent in each step (by category) to a JSON '
+             'file and log a summary.',
+        default=None,
+        action="store",
+        metavar="FILE")
+    parser.add_argument(
+        '--record',
+        help='Record the frames sent and received to a binary file.',
+        default=None,
+        action="store",
+        metavar="FILE")
+    parser.add_argument(
+        '--replay',
+        help='Send again the frames sent in a recording (instead of running '
+             'a scenario).',
+        default=None,
+        action="store",
+        metavar="FILE")
+    parser.add_argument(
+        '--replay-speed',
+        help='Pace of the replay as a multiple of the recorded one '
+             '(0 sends as fast as possible).',
+        default=1,
+        action="store",
+        metavar="FACTOR",
+        type=float)
+    parser.add_argument(
+        '--batch',
+        help='Run the scenario files given (or found in the directories '
+             'given) in parallel, on free ports, and report the results.',
+        default=None,
+        action="store",
+        nargs="+",
+        metavar="PATH")
+    parser.add_argument(
+        '--jobs', '-j',
+        help='Number of worker processes of --batch (one per CPU by '
+             'default).',
+        default=None,
+        action="store",
+        metavar="JOBS",
+        type=int)
+    parser.add_argument(
+        '--timeout',
+        help='Seconds a scenario of --batch may run for.',
+        default=60,
+        action="store",
+        metavar="SECONDS",
+        type=float)
+    parser.add_argument(
+        '--report',
+        help='Write the results of --batch to a JSON file.',
+        default=None,
+        action="store",
+        metavar="FILE")
     parser.add_argument(
         '--verbose', '-v',
         help='Verbose mode',
         default=False,
         action="store_true")
     arguments = parser.parse_args()
+    if ((arguments.scenario_file is None) and
+            (arguments.replay is None) and
+            (arguments.batch is None)):
+        parser.error("a scenario file, --replay or --batch is needed")
     log = logging.getLogger(__name__)
     handler = logging.StreamHandler()
     formatter = logging.Formatter(
@@ -33,18 +140,79 @@ def main(argv=sys.argv[1:]):
     else:
         log.setLevel(logging.INFO)
     scen.configure_logging(arguments.verbose)
+    if (arguments.replay is not None):
+        recording.replay(arguments.replay, arguments.replay_speed)
+        return
+    if (arguments.batch is not None):
+        return run_batch(arguments, log)
     scenario_file = arguments.scenario_file
     delay = arguments.delay
     log.debug('Open file "{}" as YAML scenario.'.format(scenario_file))
     log.debug('Time to wait between steps (-d): {}'.format(delay))
+    log.debug('Scheduler (-s): {}'.format(arguments.scheduler))
+    log.debug('Processes (-p): {}'.format(arguments.processes))
     with open(scenario_file, 'r') as yaml_scenario:
         yaml_content = yaml_scenario.read()
-        with scen.Scenario(yaml_content) as scenario:
+        with scen.Scenario(
+                yaml_content,
+                scheduler=arguments.scheduler,
+                processes=arguments.processes,
+                warmup=arguments.warmup,
+                cache_dir=arguments.cache_dir,
+                record=arguments.record,
+                profile=arguments.profile is not None,
+                io_threads=arguments.io_threads) as scenario:
             scenario.build()
-            while scenario.has_more_steps:
-                log.debug("step")
-                scenario.step()
-                time.sleep(delay)
+            try:
+                while scenario.has_more_steps:
+                    log.debug("step")
+                    scenario.step()
+                    time.sleep(delay)
+            finally:
+                for endpoint, counts in sorted(
+                        scenario.send_counts.items()):
+                    if (counts["blocked"]) or (counts["dropped"]):
+                        log.info(
+                            "Sends on {}: {sent} sent, {blocked} blocked, "
+                            "{dropped} dropped".format(endpoint, **counts))
+                if arguments.latency:
+                    for line in scenario.latency.format_report():
+                        log.info(line)
+                if arguments.profile:
+                    with open(arguments.profile, 'w') as profile_file:
+                        json.dump(
+                            {"steps": scenario.profiler.report()},
+                            profile_file,
+                            indent=4)
+                    for line in scenario.profiler.format_report():
+                        log.info(line)
+
+
+def run_batch(arguments, log):
+    """Run the scenarios of --batch and return the exit code (1 if one of
+    them did not pass)."""
+    runner = batch.BatchRunner(
+        arguments.batch,
+        jobs=arguments.jobs,
+        timeout=arguments.timeout,
+        scheduler=arguments.scheduler,
+        cache_dir=arguments.cache_dir,
+        verbose=arguments.verbose if arguments.verbose else None)
+    log.info("Run {} scenario files".format(len(runner.files)))
+    start = time.monotonic()
+    reports = runner.run()
+    seconds = time.monotonic() - start
+    for line in batch.format_report(reports, seconds):
+        log.info(line)
+    if (arguments.report):
+        with open(arguments.report, 'w') as report_file:
+            json.dump(
+                {"seconds": seconds, "scenarios": reports},
+                report_file,
+                indent=4)
+    if (any(batch.PASSED != report["status"] for report in reports)):
+        return 1
+    return 0
 
 
 if "__main__" == __name__:
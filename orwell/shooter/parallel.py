@@ -0,0 +1,164 @@
+import logging
+import multiprocessing
+import queue
+
+from . import log
+
+
+def partition(threads, processes):
+    """Split the indices of threads into at most `processes` groups.
+
+    Threads sharing a bound socket cannot live in different processes (the
+    second bind would fail) so they always end up in the same group, as well
+    as the threads using the same inproc endpoint (only reachable from the
+    same zmq context).
+    """
+    parents = list(range(len(threads)))
+
+    def find(index):
+        while (parents[index] != index):
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    bound = {}
+    for index, thread in enumerate(threads):
+        for socket in (thread.in_socket, thread.out_socket):
+            if ((not getattr(socket, "bind", False)) and
+                    (not socket.connection_string.startswith("inproc://"))):
+                continue
+            other = bound.setdefault(socket.connection_string, index)
+            parents[find(index)] = find(other)
+    clusters = {}
+    for index in range(len(threads)):
+        clusters.setdefault(find(index), []).append(index)
+    # biggest clusters first, each one to the least loaded process
+    groups = [[] for _ in range(max(1, processes))]
+    for cluster in sorted(clusters.values(), key=len, reverse=True):
+        min(groups, key=len).extend(cluster)
+    return [sorted(group) for group in groups if group]
+
+
+def _run_partition(
+        yaml_content, indices, scheduler, warmup, cache_dir, profile,
+        io_threads, verbose, results):
+    """Entry point of a worker process."""
+    import orwell.shooter.scenario as scen
+    if (verbose is not None):
+        scen.configure_logging(verbose)
+    report = {
+        "indices": indices, "error": None, "latency": None, "profile": None}
+    try:
+        with scen.Scenario(
+                yaml_content,
+                scheduler=scheduler,
+                warmup=warmup,
+                cache_dir=cache_dir,
+                profile=profile,
+                io_threads=io_threads) as scenario:
+            scenario.select_threads(indices)
+            try:
+                scenario.build()
+                scenario.step_all()
+            finally:
+                report["latency"] = scenario.latency
+                report["profile"] = scenario.profiler
+    except Exception as exception:
+        report["error"] = str(exception)
+    results.put(report)
+    # write what is still queued before the process ends
+    log.stop()
+
+
+class ProcessPool(object):
+    """Runs groups of threads of a scenario in worker processes.
+
+    Each worker loads the scenario again and builds only its own threads,
+    so it gets its own zmq context and capture repositories. The latencies
+    measured by the workers are merged into `latency_recorder` (and their
+    times into `profiler` if given).
+    """
+
+    # seconds to wait for a report before checking the workers are alive
+    wait_timeout = 0.1
+
+    def __init__(
+            self,
+            yaml_content,
+            partitions,
+            scheduler,
+            warmup,
+            latency_recorder,
+            cache_dir=None,
+            profiler=None,
+            io_threads=None):
+        self._yaml_content = yaml_content
+        self._partitions = partitions
+        self._scheduler = scheduler
+        self._warmup = warmup
+        self._latency_recorder = latency_recorder
+        self._cache_dir = cache_dir
+        self._profiler = profiler
+        self._io_threads = io_threads
+        # spawn as forking a process using zmq is not safe
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._processes = []
+        self._pending = set()
+
+    def start(self):
+        logger = logging.getLogger(__name__)
+        scenario_logger = logging.getLogger("orwell.shooter.scenario")
+        if (scenario_logger.handlers):
+            verbose = scenario_logger.isEnabledFor(logging.DEBUG)
+        else:
+            verbose = None
+        for number, indices in enumerate(self._partitions):
+            logger.info(
+                "Start process {} for threads {}".format(number, indices))
+            process = self._context.Process(
+                target=_run_partition,
+                args=(self._yaml_content, indices, self._scheduler,
+                      self._warmup, self._cache_dir,
+                      self._profiler is not None, self._io_threads,
+                      verbose, self._results),
+                name="shooter-{}".format(number))
+            process.start()
+            self._processes.append(process)
+            self._pending.add(tuple(indices))
+
+    @property
+    def running(self):
+        return bool(self._pending)
+
+    def wait(self):
+        """Wait for a worker to report and raise its failure if any."""
+        try:
+            report = self._results.get(timeout=self.wait_timeout)
+        except queue.Empty:
+            self._check_alive()
+            return
+        self._pending.discard(tuple(report["indices"]))
+        if (report["latency"] is not None):
+            self._latency_recorder.merge(report["latency"])
+        if ((report["profile"] is not None) and
+                (self._profiler is not None)):
+            self._profiler.merge(report["profile"])
+        if (report["error"] is not None):
+            self.terminate()
+            raise Exception(report["error"])
+
+    def _check_alive(self):
+        for process in self._processes:
+            if (process.exitcode not in (None, 0)):
+                self.terminate()
+                raise Exception(
+                    "Process '{}' exited with code {}.".format(
+                        process.name, process.exitcode))
+
+    def terminate(self):
+        for process in self._processes:
+            if (process.is_alive()):
+                process.terminate()
+            process.join()
+        self._pending.clear()
@@ -0,0 +1,83 @@
+"""zmq sockets owned by a scenario.
+
+A SocketPool holds the zmq context and the sockets bound or connected by
+the scenarios using it, keyed by endpoint, so that the wrappers sharing an
+endpoint share the zmq socket. Closing the pool closes the sockets and
+terminates the context.
+
+By default each scenario gets its own pool. A pool can also be given to
+several consecutive scenarios to keep the connections warm (the sockets
+then stay open, with the messages nobody read yet, until the pool is
+closed):
+
+    with pool.SocketPool() as socket_pool:
+        for yaml_content in scenarios:
+            with scenario.Scenario(
+                    yaml_content, socket_pool=socket_pool) as one:
+                one.build()
+                one.step_all()
+"""
+
+import zmq
+import zmq.asyncio
+
+
+class SocketPool(object):
+
+    def __init__(self, io_threads=1):
+        """`io_threads` is the number of background threads of the zmq
+        context doing the network I/O."""
+        self._zmq_context = zmq.Context(io_threads)
+        # key -> zmq.Socket
+        self._sockets = {}
+        # key -> zmq.asyncio.Socket using the socket of the same key
+        self._asynchronous = {}
+
+    @property
+    def zmq_context(self):
+        return self._zmq_context
+
+    def __len__(self):
+        return len(self._sockets)
+
+    def socket(self, key, zmq_method, setup, asynchronous=False):
+        """zmq socket for `key`, created with `setup(zmq_socket)` (which
+        binds or connects it) the first time.
+
+        With `asynchronous` the socket is returned as a zmq.asyncio socket
+        for the current event loop (the same zmq socket through the other
+        API).
+        """
+        zmq_socket = self._sockets.get(key)
+        if (zmq_socket is None):
+            zmq_socket = self._zmq_context.socket(zmq_method)
+            setup(zmq_socket)
+            self._sockets[key] = zmq_socket
+        if (not asynchronous):
+            return zmq_socket
+        asynchronous_socket = self._asynchronous.get(key)
+        if (asynchronous_socket is None):
+            asynchronous_socket = zmq.asyncio.Socket.shadow(
+                zmq_socket.underlying)
+            self._asynchronous[key] = asynchronous_socket
+        return asynchronous_socket
+
+    def release(self):
+        """Forget the asyncio sockets (bound to the event loop of the
+        scenario that is over) but keep the zmq sockets open."""
+        # closing a shadow would close the zmq socket it uses
+        self._asynchronous.clear()
+
+    def close(self):
+        """Close the sockets and terminate the context."""
+        self.release()
+        for zmq_socket in self._sockets.values():
+            zmq_socket.close()
+        self._sockets.clear()
+        self._zmq_context.term()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
@@ -0,0 +1,155 @@
+"""Where the time goes in the steps of a scenario.
+
+While a Profiler is active (see start), the code of the steps is split in
+sections (see section) and the wall and CPU times spent in each of them are
+added up per thread and per flow index. The categories are:
+
+* step: the whole step
+* poll: waiting for and reading a message from a socket
+* decode: parsing the header and the protobuf payload of a message
+* match: comparing a message with the expected one
+* expand: evaluating the expressions
+* encode: filling and serializing a message
+* send: writing a message to a socket
+
+The CPU time is the one of the current thread so with the asyncio scheduler
+it also counts the other coroutines running while a section waits.
+"""
+
+import contextlib
+import contextvars
+import time
+
+CATEGORIES = ("step", "poll", "decode", "match", "expand", "encode", "send")
+
+# Profiler the sections are added to (None when not profiling)
+_active = None
+# (thread name, flow index) of the step being run
+_STEP = contextvars.ContextVar("profiled_step", default=None)
+
+_NULL = contextlib.nullcontext()
+
+
+class Profiler(object):
+    """Times by step (thread name and flow index) and by category.
+
+    Each time is a list [count, wall seconds, CPU seconds] so that it is
+    cheap to update and to send to another process.
+    """
+
+    def __init__(self):
+        # (thread name, flow index) -> category -> [count, wall, cpu]
+        self.steps = {}
+        # (thread name, flow index) -> description of the step
+        self.labels = {}
+
+    def times(self, step, category):
+        categories = self.steps.get(step)
+        if (categories is None):
+            categories = self.steps[step] = {}
+        times = categories.get(category)
+        if (times is None):
+            times = categories[category] = [0, 0.0, 0.0]
+        return times
+
+    def merge(self, other):
+        for step, categories in other.steps.items():
+            for category, (count, wall, cpu) in categories.items():
+                times = self.times(step, category)
+                times[0] += count
+                times[1] += wall
+                times[2] += cpu
+        for step, label in other.labels.items():
+            self.labels.setdefault(step, label)
+
+    def report(self):
+        """List of the steps with their times by category (in seconds)."""
+        return [
+            {
+                "thread": thread,
+                "index": index,
+                "step": self.labels.get((thread, index), ""),
+                "sections": {
+                    category: {"count": count, "wall": wall, "cpu": cpu}
+                    for category, (count, wall, cpu) in categories.items()},
+            }
+            for (thread, index), categories in sorted(self.steps.items())]
+
+    def format_report(self):
+        """Human readable report as a list of lines (in milliseconds)."""
+        rows = [("{} #{} {}".format(
+                    thread, index, self.labels.get((thread, index), "")),
+                 categories)
+                for (thread, index), categories in sorted(self.steps.items())]
+        width = max([len("wall / cpu (ms)")] + [len(name) for name, _ in rows])
+        lines = ["{:<{}} {:>7} {}".format(
+            "wall / cpu (ms)", width, "count",
+            " ".join("{:>17}".format(category) for category in CATEGORIES))]
+        for name, categories in rows:
+            count = categories.get("step", (0,))[0]
+            values = []
+            for category in CATEGORIES:
+                _, wall, cpu = categories.get(category, (0, 0.0, 0.0))
+                values.append("{:>8.3f}/{:<8.3f}".format(
+                    wall * 1e3, cpu * 1e3))
+            lines.append("{:<{}} {:>7} {}".format(
+                name, width, count, " ".join(values)))
+        return lines
+
+
+def _label(element):
+    label = getattr(element, "yaml_tag", type(element).__name__)
+    message = getattr(element, "message", None)
+    if (message is not None):
+        label += " " + getattr(message, "message_type", "")
+    return label
+
+
+def start(profiler):
+    """Add the times of the sections to profiler (until stop)."""
+    global _active
+    _active = profiler
+
+
+def stop():
+    global _active
+    _active = None
+
+
+def set_step(thread_name, index, element):
+    """Attribute the next sections to the given step (element is the step
+    object, only used to describe it)."""
+    if (_active is None):
+        return
+    step = (thread_name, index)
+    if (step not in _active.labels):
+        _active.labels[step] = _label(element)
+    _STEP.set(step)
+
+
+class _Section(object):
+    __slots__ = ("_times", "_wall", "_cpu")
+
+    def __init__(self, times):
+        self._times = times
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        times = self._times
+        times[0] += 1
+        times[1] += time.perf_counter() - self._wall
+        times[2] += time.thread_time() - self._cpu
+
+
+def section(category):
+    """Context manager timing what it wraps (does nothing when not
+    profiling or outside of a step)."""
+    if (_active is None):
+        return _NULL
+    step = _STEP.get()
+    if (step is None):
+        return _NULL
+    return _Section(_active.times(step, category))
@@ -0,0 +1,238 @@
+"""Recording of the traffic of a scenario and replay of the recordings.
+
+A recording is a binary file starting with HEADER followed by records.
+Each record starts with its length (not counting the length itself) and
+its kind:
+
+* a socket declaration (SOCKET): identifier, zmq socket type, whether it
+  was bound and the connection string
+* a frame (FRAME): nanoseconds since the beginning of the recording,
+  identifier of the socket, direction (SENT or RECEIVED), lengths of the
+  destination and of the message type then the destination, the message
+  type and the payload
+
+All the integers are little endian.
+"""
+
+import collections
+import logging
+import mmap
+import struct
+import time
+
+import zmq
+
+from .. import yaml2protobuf
+
+MAGIC = b"SHOOTREC"
+VERSION = 1
+HEADER = struct.Struct("<8sH")
+# length of what follows, kind
+RECORD = struct.Struct("<IB")
+# socket identifier, zmq socket type, bind
+SOCKET = struct.Struct("<HiB")
+# timestamp, socket identifier, direction, destination length, type length
+FRAME = struct.Struct("<QHBHH")
+
+KIND_SOCKET = 0
+KIND_FRAME = 1
+
+SENT = 0
+RECEIVED = 1
+
+# socket types the frames of which can be sent again without a peer talking
+# first
+REPLAYABLE = frozenset((zmq.PUSH, zmq.PUB))
+
+SocketRecord = collections.namedtuple(
+    "SocketRecord", ("socket_id", "zmq_type", "bind", "connection_string"))
+
+FrameRecord = collections.namedtuple(
+    "FrameRecord",
+    ("timestamp", "socket_id", "direction", "destination", "message_type",
+     "payload"))
+
+
+class Recorder(object):
+    """Writes the frames going through the sockets of a scenario.
+
+    The sockets call record for each frame once they have a recorder (see
+    Socket.recorder).
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION))
+        # id of the zmq socket -> identifier in the recording
+        self._socket_ids = {}
+        self._start = time.monotonic_ns()
+        self.frames = 0
+
+    def _socket_id(self, socket):
+        # sockets sharing a zmq socket are recorded as one
+        key = id(socket.zmq_socket)
+        socket_id = self._socket_ids.get(key)
+        if (socket_id is None):
+            socket_id = len(self._socket_ids)
+            self._socket_ids[key] = socket_id
+            connection_string = socket.connection_string.encode("utf8")
+            self._file.write(RECORD.pack(
+                SOCKET.size + len(connection_string), KIND_SOCKET))
+            self._file.write(SOCKET.pack(
+                socket_id, socket.zmq_method, bool(socket.bind)))
+            self._file.write(connection_string)
+        return socket_id
+
+    def record(self, socket, direction, data):
+        """Write one frame (bytes or any buffer like a zmq.Frame)."""
+        timestamp = time.monotonic_ns() - self._start
+        socket_id = self._socket_id(socket)
+        try:
+            destination, message_type, payload = \
+                yaml2protobuf.split_header(data)
+            destination = destination.encode("utf8")
+            message_type = message_type.encode("utf8")
+        except Exception:
+            # kept as is (replayed as the payload alone)
+            destination = message_type = b""
+            payload = memoryview(data)
+        self._file.write(RECORD.pack(
+            FRAME.size + len(destination) + len(message_type) +
+            payload.nbytes,
+            KIND_FRAME))
+        self._file.write(FRAME.pack(
+            timestamp, socket_id, direction,
+            len(destination), len(message_type)))
+        self._file.write(destination)
+        self._file.write(message_type)
+        self._file.write(payload)
+        self.frames += 1
+
+    def close(self):
+        if (not self._file.closed):
+            self._file.close()
+            logging.getLogger(__name__).info(
+                "Recorded %i frames in '%s'.", self.frames, self._path)
+
+
+def read(path):
+    """Iterate over the records (SocketRecord or FrameRecord) of a file.
+
+    The file is mapped in memory and only the record being read is copied.
+    """
+    with open(path, "rb") as recording:
+        with mmap.mmap(recording.fileno(), 0, access=mmap.ACCESS_READ) \
+                as data:
+            if (len(data) < HEADER.size):
+                raise Exception("Invalid recording '{}'.".format(path))
+            magic, version = HEADER.unpack_from(data, 0)
+            if (MAGIC != magic):
+                raise Exception("Invalid recording '{}'.".format(path))
+            if (VERSION != version):
+                raise Exception(
+                    "Unsupported recording version {} in '{}'.".format(
+                        version, path))
+            offset = HEADER.size
+            end = len(data)
+            while (offset < end):
+                if (offset + RECORD.size > end):
+                    raise Exception(
+                        "Truncated recording '{}'.".format(path))
+                length, kind = RECORD.unpack_from(data, offset)
+                offset += RECORD.size
+                if (offset + length > end):
+                    raise Exception(
+                        "Truncated recording '{}'.".format(path))
+                if (KIND_SOCKET == kind):
+                    socket_id, zmq_type, bind = SOCKET.unpack_from(
+                        data, offset)
+                    connection_string = data[
+                        offset + SOCKET.size:offset + length].decode("utf8")
+                    yield SocketRecord(
+                        socket_id, zmq_type, bool(bind), connection_string)
+                elif (KIND_FRAME == kind):
+                    (timestamp, socket_id, direction,
+                     destination_length, type_length) = FRAME.unpack_from(
+                        data, offset)
+                    start = offset + FRAME.size
+                    destination = data[start:start + destination_length]
+                    start += destination_length
+                    message_type = data[start:start + type_length]
+                    start += type_length
+                    yield FrameRecord(
+                        timestamp, socket_id, direction,
+                        destination.decode("utf8"),
+                        message_type.decode("utf8"),
+                        data[start:offset + length])
+                # unknown kinds are skipped
+                offset += length
+
+
+def replay(path, speed=1.0, zmq_context=None, linger=1000):
+    """Send again the frames sent during a recording.
+
+    The frames are sent at the pace they were recorded at multiplied by
+    `speed` (2 is twice as fast) or as fast as possible if `speed` is 0.
+    Only the frames sent on push and publish sockets are replayed (the
+    others need a peer to talk first) and not those of inproc sockets.
+    `linger` is the number of milliseconds to wait for the frames to be
+    delivered at the end.
+    Return a dictionary with the number of frames sent and skipped and the
+    duration of the replay.
+    """
+    if (speed < 0):
+        raise Exception("Invalid replay speed: {}".format(speed))
+    logger = logging.getLogger(__name__)
+    context = zmq_context or zmq.Context()
+    sockets = {}
+    sent = skipped = 0
+    start = first = None
+    try:
+        for record in read(path):
+            if (isinstance(record, SocketRecord)):
+                if ((record.zmq_type not in REPLAYABLE) or
+                        record.connection_string.startswith("inproc://")):
+                    # inproc endpoints only exist in the recorded process
+                    continue
+                zmq_socket = context.socket(record.zmq_type)
+                zmq_socket.setsockopt(zmq.LINGER, linger)
+                if (record.bind):
+                    zmq_socket.bind(record.connection_string)
+                else:
+                    zmq_socket.connect(record.connection_string)
+                sockets[record.socket_id] = zmq_socket
+                continue
+            if (SENT != record.direction):
+                continue
+            zmq_socket = sockets.get(record.socket_id)
+            if (zmq_socket is None):
+                skipped += 1
+                continue
+            if (start is None):
+                start = time.monotonic()
+                first = record.timestamp
+            if (speed):
+                delay = (start + (record.timestamp - first) / 1e9 / speed -
+                         time.monotonic())
+                if (delay > 0):
+                    time.sleep(delay)
+            if (record.destination or record.message_type):
+                frame = b" ".join((
+                    record.destination.encode("utf8"),
+                    record.message_type.encode("utf8"),
+                    record.payload))
+            else:
+                frame = record.payload
+            zmq_socket.send(frame)
+            sent += 1
+    finally:
+        for zmq_socket in sockets.values():
+            zmq_socket.close()
+        if (zmq_context is None):
+            context.term()
+    seconds = (time.monotonic() - start) if (start is not None) else 0
+    logger.info(
+        "Replayed %i frames in %.3f seconds (%i skipped).",
+        sent, seconds, skipped)
+    return {"sent": sent, "skipped": skipped, "seconds": seconds}
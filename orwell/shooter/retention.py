@@ -0,0 +1,152 @@
+"""How many of the messages received by a thread are kept.
+
+A thread accepts a `retention` attribute which is either one policy for all
+the message types or a mapping from message type to policy (with an
+optional `default` entry). A policy is one of:
+
+* `all`: keep every message
+* `referenced`: keep only the messages the expressions of the thread can
+  access (like the first one for `{Registered[0].robot_id}` or the last one
+  for `{Ping[-1].logger_1}`; `{len(Hello)}` needs none)
+* N or `{last: N}`: keep the last N messages
+* `{seconds: S}`: keep the messages received in the last S seconds (can be
+  combined with `last`)
+"""
+
+import collections
+import time
+
+
+class Policy(object):
+    def __init__(self, last=None, seconds=None, referenced=False):
+        self.last = last
+        self.seconds = seconds
+        self.referenced = referenced
+
+    def __repr__(self):
+        return "{Policy | last=%s seconds=%s referenced=%s}" % (
+            self.last, self.seconds, self.referenced)
+
+
+ALL = Policy()
+REFERENCED = Policy(referenced=True)
+
+_POLICY_KEYS = frozenset(("last", "seconds"))
+
+
+def parse_policy(value):
+    if (value is None) or ("all" == value):
+        return ALL
+    if ("referenced" == value):
+        return REFERENCED
+    if (isinstance(value, int) and (not isinstance(value, bool)) and
+            (value >= 0)):
+        return Policy(last=value)
+    if (isinstance(value, dict) and value and
+            (_POLICY_KEYS.issuperset(value))):
+        last = value.get("last")
+        seconds = value.get("seconds")
+        if ((last is not None) and
+                ((not isinstance(last, int)) or (last < 0))):
+            raise Exception("Invalid retention last: {}".format(last))
+        if ((seconds is not None) and (seconds <= 0)):
+            raise Exception("Invalid retention seconds: {}".format(seconds))
+        return Policy(last=last, seconds=seconds)
+    raise Exception("Invalid retention policy: {}".format(value))
+
+
+class Retention(object):
+    """Policies of a thread by message type."""
+
+    def __init__(self, value=None, default=ALL):
+        self._by_type = {}
+        self._default = default
+        if (isinstance(value, dict) and
+                (not _POLICY_KEYS.issuperset(value))):
+            for message_type, policy in value.items():
+                if ("default" == message_type):
+                    self._default = parse_policy(policy)
+                else:
+                    self._by_type[message_type] = parse_policy(policy)
+        elif (value is not None):
+            self._default = parse_policy(value)
+
+    def policy(self, message_type):
+        return self._by_type.get(message_type, self._default)
+
+
+class CaptureHistory(object):
+    """Messages received for one type.
+
+    Seen from expressions as the list of all the messages received (the
+    length and the indices count every message) but only some of them are
+    kept: the `first` ones, the `last` ones (all of them if None) and, if
+    `seconds` is given, only those younger than that. Accessing a message
+    that was not kept raises an IndexError.
+    """
+
+    def __init__(self, first=0, last=None, seconds=None):
+        self._count = 0
+        self._first = []
+        self.configure(first, last, seconds)
+
+    def configure(self, first=0, last=None, seconds=None):
+        """Change what is kept (before any message is appended)."""
+        self._first_count = first
+        self._seconds = seconds
+        if (last is None) and (seconds is None):
+            self._last = []
+        else:
+            self._last = collections.deque(maxlen=last)
+        # reception times of the messages in _last (if seconds is given)
+        self._times = collections.deque(maxlen=last)
+
+    def append(self, value):
+        if (self._count < self._first_count):
+            self._first.append(value)
+        self._count += 1
+        self._last.append(value)
+        if (self._seconds is not None):
+            self._times.append(time.monotonic())
+            self._expire()
+
+    def _expire(self):
+        limit = time.monotonic() - self._seconds
+        while (self._times and (self._times[0] < limit)):
+            self._times.popleft()
+            self._last.popleft()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if (isinstance(index, slice)):
+            return [self[position]
+                    for position in range(*index.indices(self._count))]
+        if (index < 0):
+            index += self._count
+        if (index < 0) or (index >= self._count):
+            raise IndexError("list index out of range")
+        if (index < len(self._first)):
+            return self._first[index]
+        if (self._seconds is not None):
+            self._expire()
+        offset = index - (self._count - len(self._last))
+        if (offset < 0):
+            raise IndexError(
+                "message {} of {} was not retained".format(
+                    index, self._count))
+        return self._last[offset]
+
+    def __iter__(self):
+        """Iterate over the messages kept."""
+        if (self._seconds is not None):
+            self._expire()
+        kept = self._count - len(self._last)
+        for value in self._first[:kept]:
+            yield value
+        for value in self._last:
+            yield value
+
+    def __repr__(self):
+        return repr(list(self))
@@ -1,13 +1,24 @@
 from .. import yaml2protobuf
+from . import expression
+from . import latency
+from . import loading
+from . import log
+from . import parallel
+from . import pool
+from . import profiling
+from . import recording
+from . import retention
 import yaml
 import zmq
-import collections
-import re
+import asyncio
+import copy
+import math
 import time
+import uuid
 import logging
 
-global THREAD
-THREAD = ""
+logger = log.get_logger(__name__)
+
 
 class Socket(object):
     """Base class for zmq socket wrappers.
@@ -16,12 +27,47 @@ class Socket(object):
     the derived classes.
     """
 
-    SOCKETS = {}
+    # milliseconds to wait for a message in recv
+    poll_timeout = 10
+    # recording.Recorder the frames are written to (if any)
+    recorder = None
+    # transports where the address is the whole endpoint
+    PORTLESS_PROTOCOLS = ("inproc", "ipc")
+    # milliseconds to wait for the messages not sent yet when closing
+    linger = 1
+    # YAML attribute -> zmq option set before binding or connecting
+    OPTIONS = {
+        "sndhwm": zmq.SNDHWM,
+        "rcvhwm": zmq.RCVHWM,
+        "sndbuf": zmq.SNDBUF,
+        "rcvbuf": zmq.RCVBUF,
+    }
+    # what a send does when it would block (no peer ready or high water
+    # mark reached): wait, drop the message or fail the step
+    SEND_POLICIES = ("block", "drop", "fail")
+    send_policy = "block"
+
+    @property
+    def zmq_socket(self):
+        return self._zmq_socket
 
     @property
     def connection_string(self):
+        """Endpoint of the socket.
+
+        With the inproc and ipc protocols the address is the whole endpoint
+        (like `server` for inproc://server, which only reaches the sockets
+        of the same scenario, or `/tmp/server.ipc`) and there is no port.
+        """
         bind = getattr(self, 'bind', False)
         protocol = getattr(self, 'protocol', "tcp")
+        if (protocol in Socket.PORTLESS_PROTOCOLS):
+            address = getattr(self, 'address', None)
+            if (not address):
+                raise Exception(
+                    "Socket with protocol {} needs an address.".format(
+                        protocol))
+            return "%s://%s" % (protocol, address)
         if (bind):
             address = getattr(self, 'address', "0.0.0.0")
         else:
@@ -43,26 +89,92 @@ class Socket(object):
         if (zmq.REP == self.zmq_method):
             return "reply"
 
-    def build(self, zmq_context):
-        logger = logging.getLogger(__name__)
+    def _received(self, data):
+        if (self.recorder is not None) and (data is not None):
+            self.recorder.record(self, recording.RECEIVED, data)
+        return data
+
+    def _sent(self, data):
+        self.send_counts["sent"] += 1
+        if (self.recorder is not None):
+            self.recorder.record(self, recording.SENT, data)
+
+    def _send(self, data):
+        """Send data following send_policy and return whether it was
+        sent."""
+        try:
+            self._zmq_socket.send(data, zmq.NOBLOCK)
+        except zmq.Again:
+            if (not self._would_block()):
+                return False
+            self._zmq_socket.send(data)
+        self._sent(data)
+        return True
+
+    async def _send_async(self, data):
+        try:
+            await self._zmq_socket.send(data, zmq.NOBLOCK)
+        except zmq.Again:
+            if (not self._would_block()):
+                return False
+            await self._zmq_socket.send(data)
+        self._sent(data)
+        return True
+
+    def _would_block(self):
+        """Count a send that cannot be done now and tell whether to wait."""
+        if ("block" == self.send_policy):
+            self.send_counts["blocked"] += 1
+            return True
+        self.send_counts["dropped"] += 1
+        logger.warning(
+            "Message not sent on %s (send policy: %s)",
+            self.connection_string, self.send_policy)
+        return False
+
+    def replicate(self, index):
+        """Socket to be used by the replica `index` of a thread.
+
+        A bound socket is shared by all the replicas but each replica gets
+        its own connected socket (so that every subscriber sees all the
+        published messages).
+        """
+        if (getattr(self, 'bind', False)):
+            return self
+        replica = copy.copy(self)
+        replica.replica = index
+        return replica
+
+    def build(self, socket_pool, asynchronous=False):
+        """Get the zmq socket from socket_pool (the wrappers with the same
+        endpoint share it)."""
         bind = getattr(self, 'bind', False)
-        connection_string = self.connection_string
-        key = connection_string + "#" + str(bind)
+        key = self.connection_string + "#" + str(bind)
+        replica = getattr(self, 'replica', None)
+        if (replica is not None):
+            key += "#" + str(replica)
         self.bind = bind
-        if (key in Socket.SOCKETS):
-            self._zmq_socket = Socket.SOCKETS[key]
+        if (self.send_policy not in Socket.SEND_POLICIES):
+            raise Exception(
+                "Unknown send policy: '{}'".format(self.send_policy))
+        # sends that waited and sends not done (dropped or failed)
+        self.send_counts = {"sent": 0, "blocked": 0, "dropped": 0}
+        self._zmq_socket = socket_pool.socket(
+            key, self.zmq_method, self._setup, asynchronous)
+
+    def _setup(self, zmq_socket):
+        zmq_socket.setsockopt(zmq.LINGER, self.linger)
+        for name, option in Socket.OPTIONS.items():
+            value = getattr(self, name, None)
+            if (value is not None):
+                zmq_socket.setsockopt(option, value)
+        if (self.bind):
+            logger.info("Bind on %s %s", self.connection_string, self.mode)
+            zmq_socket.bind(self.connection_string)
         else:
-            self._zmq_socket = zmq_context.socket(self.zmq_method)
-            self._zmq_socket.setsockopt(zmq.LINGER, 1)
-            if (bind):
-                logger.info(
-                    THREAD + "Bind on " + self.connection_string + " " + self.mode)
-                self._zmq_socket.bind(self.connection_string)
-            else:
-                logger.info(
-                    THREAD + "Connect to " + self.connection_string + " " + self.mode)
-                self._zmq_socket.connect(self.connection_string)
-            Socket.SOCKETS[key] = self._zmq_socket
+            logger.info(
+                "Connect to %s %s", self.connection_string, self.mode)
+            zmq_socket.connect(self.connection_string)
 
     def __repr__(self):
         return "{%s | %s}" % (self.yaml_tag[1:], self.connection_string)
@@ -78,12 +190,17 @@ class SocketPull(yaml.YAMLObject, Socket):
     zmq_method = zmq.PULL
 
     def recv(self, *args, **kwargs):
-        event = self._zmq_socket.poll(10)
+        event = self._zmq_socket.poll(self.poll_timeout)
         if (zmq.POLLIN == event):
-            return self._zmq_socket.recv(*args, **kwargs)
+            return self._received(
+                self._zmq_socket.recv(*args, **kwargs))
         else:
             return None
 
+    async def recv_async(self, *args, **kwargs):
+        return self._received(
+            await self._zmq_socket.recv(*args, **kwargs))
+
 
 class SocketPush(yaml.YAMLObject, Socket):
 
@@ -96,9 +213,14 @@ class SocketPush(yaml.YAMLObject, Socket):
     zmq_method = zmq.PUSH
 
     def send(self, data):
-        logger = logging.getLogger(__name__)
-        logger.info(THREAD + "SocketPush.send({})".format(repr(data)))
-        self._zmq_socket.send(data)
+        logger.info("SocketPush.send(%i bytes)", len(data))
+        logger.debug("SocketPush.send(%r)", data)
+        return self._send(data)
+
+    async def send_async(self, data):
+        logger.info("SocketPush.send(%i bytes)", len(data))
+        logger.debug("SocketPush.send(%r)", data)
+        return await self._send_async(data)
 
 
 class SocketSubscribe(yaml.YAMLObject, Socket):
@@ -110,19 +232,23 @@ class SocketSubscribe(yaml.YAMLObject, Socket):
     yaml_tag = u'!SocketSubscribe'
     zmq_method = zmq.SUB
 
-    def build(self, zmq_context):
-        super(self.__class__, self).build(zmq_context)
+    def build(self, socket_pool, asynchronous=False):
+        super(self.__class__, self).build(socket_pool, asynchronous)
         self._zmq_socket.setsockopt_string(zmq.SUBSCRIBE, "")
 
     def recv(self, *args, **kwargs):
-        event = self._zmq_socket.poll(10)
-        logger = logging.getLogger(__name__)
-        logger.debug(THREAD + "event = " + str(event))
+        event = self._zmq_socket.poll(self.poll_timeout)
+        logger.debug("event = %s", event)
         if (zmq.POLLIN == event):
-            return self._zmq_socket.recv(*args, **kwargs)
+            return self._received(
+                self._zmq_socket.recv(*args, **kwargs))
         else:
             return None
 
+    async def recv_async(self, *args, **kwargs):
+        return self._received(
+            await self._zmq_socket.recv(*args, **kwargs))
+
 
 class SocketPublish(yaml.YAMLObject, Socket):
     """To be used in YAML.
@@ -134,9 +260,14 @@ class SocketPublish(yaml.YAMLObject, Socket):
     zmq_method = zmq.PUB
 
     def send(self, data):
-        logger = logging.getLogger(__name__)
-        logger.info(THREAD + "SocketPublish.send({})".format(repr(data)))
-        self._zmq_socket.send(data)
+        logger.info("SocketPublish.send(%i bytes)", len(data))
+        logger.debug("SocketPublish.send(%r)", data)
+        return self._send(data)
+
+    async def send_async(self, data):
+        logger.info("SocketPublish.send(%i bytes)", len(data))
+        logger.debug("SocketPublish.send(%r)", data)
+        return await self._send_async(data)
 
 
 class SocketReply(yaml.YAMLObject, Socket):
@@ -149,18 +280,27 @@ class SocketReply(yaml.YAMLObject, Socket):
     zmq_method = zmq.REP
 
     def recv(self, *args, **kwargs):
-        event = self._zmq_socket.poll(10)
-        logger = logging.getLogger(__name__)
-        logger.debug(THREAD + "event = " + str(event))
+        event = self._zmq_socket.poll(self.poll_timeout)
+        logger.debug("event = %s", event)
         if (zmq.POLLIN == event):
-            return self._zmq_socket.recv(*args, **kwargs)
+            return self._received(
+                self._zmq_socket.recv(*args, **kwargs))
         else:
             return None
 
     def send(self, data):
-        logger = logging.getLogger(__name__)
-        logger.info(THREAD + "SocketReply.send({})".format(repr(data)))
-        self._zmq_socket.send(data)
+        logger.info("SocketReply.send(%i bytes)", len(data))
+        logger.debug("SocketReply.send(%r)", data)
+        return self._send(data)
+
+    async def recv_async(self, *args, **kwargs):
+        return self._received(
+            await self._zmq_socket.recv(*args, **kwargs))
+
+    async def send_async(self, data):
+        logger.info("SocketReply.send(%i bytes)", len(data))
+        logger.debug("SocketReply.send(%r)", data)
+        return await self._send_async(data)
 
 
 class ExchangeMetaClass(type):
@@ -216,41 +356,152 @@ class In(yaml.YAMLObject, Exchange):
     """To be used in YAML.
 
     Class to receive messages in a thread.
+    With `timeout` (seconds) the step fails if no matching message arrived
+    in time and with `within` (milliseconds) the message must arrive within
+    that time after the last message sent by the thread.
     """
 
     __metaclass__ = ExchangeMetaClass
     yaml_tag = u'!In'
+    # the thread can only progress when in_socket has something to read
+    waits_for_message = True
+
+    def build(self, repository, in_socket, out_socket):
+        super(In, self).build(repository, in_socket, out_socket)
+        # compile the comparison with the template now rather than on the
+        # first message received
+        self.message.matcher
+        self._exact = getattr(self, "exact", False)
+        expected = getattr(self, "destination", None)
+        if (expected is not None):
+            self._destination = repository.compile(expected)
+        else:
+            self._destination = None
+        self._timeout = getattr(self, "timeout", None)
+        self._within = getattr(self, "within", None)
+        self._expiry = None
+
+    @property
+    def expiry(self):
+        """Time (as in time.monotonic()) at which the step fails if no
+        matching message arrived (None without timeout nor within).
+
+        The timeout starts when the expiry is first asked for.
+        """
+        if (self._expiry is None):
+            expiries = []
+            if (self._timeout is not None):
+                expiries.append(time.monotonic() + self._timeout)
+            last_sent = self._repository.timing.last_sent
+            if (self._within is not None) and (last_sent is not None):
+                expiries.append(last_sent / 1e9 + self._within / 1000.0)
+            if (expiries):
+                self._expiry = min(expiries)
+        return self._expiry
 
     def step(self):
-        logger = logging.getLogger(__name__)
-        logger.debug(THREAD + "In.step")
+        logger.debug("In.step")
+        # start the timeout
+        self.expiry
+        try:
+            with profiling.section("poll"):
+                zmq_message = self._in_socket.recv(copy=False)
+        except Exception as ex:
+            logger.warning("Exception in In.step: %s", ex)
+            zmq_message = None
+        return self._receive(zmq_message)
+
+    async def step_async(self):
+        logger.debug("In.step")
+        expiry = self.expiry
         try:
-            zmq_message = self._in_socket.recv()
+            with profiling.section("poll"):
+                receive = self._in_socket.recv_async(copy=False)
+                if (expiry is not None):
+                    receive = asyncio.wait_for(
+                        receive, max(0, expiry - time.monotonic()))
+                zmq_message = await receive
+        except asyncio.CancelledError:
+            # an Exception before Python 3.8
+            raise
+        except asyncio.TimeoutError:
+            zmq_message = None
         except Exception as ex:
-            logger.warning(THREAD + "Exception in In.step:" + str(ex))
+            logger.warning("Exception in In.step: %s", ex)
             zmq_message = None
+        return self._receive(zmq_message)
+
+    def _receive(self, zmq_message):
         if (zmq_message):
-            logger.info(THREAD + "received zmq message %s" % repr(zmq_message))
-            message = yaml2protobuf.Capture.create_from_zmq(zmq_message)
-            if (message.message_type != self.message.message_type):
-                logger.info(THREAD + "message type does not match %s"
-                        % self.message.message_type)
+            # only the header is decoded until we know the message is for
+            # this step
+            with profiling.section("decode"):
+                destination, message_type, payload = (
+                    yaml2protobuf.split_header(zmq_message))
+            logger.info(
+                "received zmq message %s %s (%i bytes)",
+                destination, message_type, len(payload))
+            if (logger.isEnabledFor(logging.DEBUG)):
+                logger.debug("payload = %r", bytes(payload))
+            if (message_type != self.message.message_type):
+                logger.info(
+                    "message type does not match %s",
+                    self.message.message_type)
+                zmq_message = None
+            elif (not self._is_for_us(destination)):
+                logger.info("destination does not match %s", destination)
                 zmq_message = None
             else:
+                with profiling.section("decode"):
+                    message = yaml2protobuf.Capture.decode(
+                        destination, message_type, payload)
                 self.message.destination = message.destination
                 self.message.raw = message._pb_message
                 # print("type(self.message) = " + str(type(self.message)))
                 # print("id(self.message) = " + str(hex(id(self.message))))
-                differences = self.message.compute_differences(message)
-                logger.info(THREAD + "differences = " + str(differences))
-                # @TODO: implement exact match
-                if (differences):
-                    # zmq_message = None
-                    pass
-                # else:
-                self._repository.add_received_message(self.message)
+                with profiling.section("match"):
+                    differences = self.message.compute_differences(
+                        message, self._exact)
+                logger.info("differences = %s", differences)
+                if (differences and self._exact):
+                    logger.info("message does not match exactly")
+                    zmq_message = None
+                else:
+                    self._repository.add_received_message(self.message)
+                    waited = self._repository.timing.received(
+                        self.message.message_type)
+                    return self._check_within(waited), True
+        if (self._expiry is not None) and (time.monotonic() >= self._expiry):
+            logger.warning(
+                "No %s received in time", self.message.message_type)
+            self._expiry = None
+            return False, True
         return zmq_message, zmq_message is not None
 
+    def _check_within(self, waited):
+        """Result of the step for a message received `waited` nanoseconds
+        after the last message sent (None if nothing was sent)."""
+        self._expiry = None
+        if (self._within is None):
+            return True
+        if (waited is None):
+            logger.warning(
+                "No message sent before %s to measure within",
+                self.message.message_type)
+            return False
+        if (waited > self._within * 1e6):
+            logger.warning(
+                "%s received after %.3f ms (within %s ms)",
+                self.message.message_type, waited / 1e6, self._within)
+            return False
+        return True
+
+    def _is_for_us(self, destination):
+        """Check the destination if the step filters on it."""
+        if (self._destination is None):
+            return True
+        return (self._repository.evaluate(self._destination) == destination)
+
 
 class Out(yaml.YAMLObject, Exchange):
     """To be used in YAML.
@@ -263,19 +514,146 @@ class Out(yaml.YAMLObject, Exchange):
     arguments = {}
 
     def build(self, repository, in_socket, out_socket):
-        super(self.__class__, self).build(repository, in_socket, out_socket)
+        super(Out, self).build(repository, in_socket, out_socket)
+        # compile the encoding of the message now rather than when sending
+        self.message.encoding_plan
+        self._arguments = {key: repository.compile(value)
+                           for key, value in self.arguments.items()}
 
     def step(self):
-        logger = logging.getLogger(__name__)
-        logger.info(THREAD + "Out.step")
-        logger.debug(THREAD + "arguments = " + str(self.arguments))
-        expanded_arguments = {key: self._repository.expand(value)
-                              for key, value in self.arguments.items()}
-        logger.debug(THREAD + "expanded arguments = " + str(expanded_arguments))
-        self._out_socket.send(
-            self.message.encode_zmq_message(expanded_arguments))
+        data = self._encode()
+        self._repository.timing.sent(self.message.message_type)
+        with profiling.section("send"):
+            sent = self._out_socket.send(data)
+        return self._result(sent), True
+
+    async def step_async(self):
+        data = self._encode()
+        self._repository.timing.sent(self.message.message_type)
+        with profiling.section("send"):
+            sent = await self._out_socket.send_async(data)
+        return self._result(sent), True
+
+    def _result(self, sent):
+        # a message not sent fails the step with the "fail" send policy
+        if (sent) or ("fail" != self._out_socket.send_policy):
+            return None
+        return False
+
+    def _encode(self):
+        logger.info("Out.step")
+        logger.debug("arguments = %s", self.arguments)
+        expanded_arguments = {key: self._repository.evaluate(value)
+                              for key, value in self._arguments.items()}
+        logger.debug("expanded arguments = %s", expanded_arguments)
+        with profiling.section("encode"):
+            return self.message.encode_zmq_message(expanded_arguments)
+
+
+class OutRate(Out):
+    """To be used in YAML.
+
+    Class to send the same message repeatedly at a given rate (messages per
+    second) either `count` times or for `seconds` seconds.
+    The sends follow a fixed schedule (open loop): when late, the missed
+    messages are sent as soon as possible to catch up.
+    """
+
+    yaml_tag = u'!OutRate'
+
+    def build(self, repository, in_socket, out_socket):
+        super(OutRate, self).build(repository, in_socket, out_socket)
+        if (self.rate <= 0):
+            raise Exception("Rate must be positive, not {}.".format(self.rate))
+        if (hasattr(self, "count")):
+            self._total = self.count
+        elif (hasattr(self, "seconds")):
+            self._total = int(self.rate * self.seconds)
+        else:
+            raise Exception("OutRate needs either count or seconds.")
+        self._start = None
+        # time.monotonic() value of the next send when waiting for it
+        self.deadline = None
+        self.report = None
+
+    def step(self):
+        now = time.monotonic()
+        if (self._start is None):
+            self._begin(now)
+        while (self._sent < self._total):
+            due = self._due()
+            if (now < due):
+                self.deadline = due
+                return None, False
+            data = self._encode()
+            self._repository.timing.sent(self.message.message_type)
+            with profiling.section("send"):
+                sent = self._out_socket.send(data)
+            if (self._result(sent) is not None):
+                self._finish(now)
+                return False, True
+            self._sent_at(due, now)
+            now = time.monotonic()
+        self._finish(now)
+        return None, True
+
+    async def step_async(self):
+        self._begin(time.monotonic())
+        while (self._sent < self._total):
+            due = self._due()
+            now = time.monotonic()
+            if (now < due):
+                await asyncio.sleep(due - now)
+                now = time.monotonic()
+            data = self._encode()
+            self._repository.timing.sent(self.message.message_type)
+            with profiling.section("send"):
+                sent = await self._out_socket.send_async(data)
+            if (self._result(sent) is not None):
+                self._finish(now)
+                return False, True
+            self._sent_at(due, now)
+        self._finish(time.monotonic())
         return None, True
 
+    def _begin(self, now):
+        self._start = now
+        self._sent = 0
+        self._total_lag = 0
+        self._max_lag = 0
+
+    def _due(self):
+        return self._start + self._sent / self.rate
+
+    def _sent_at(self, due, now):
+        lag = now - due
+        self._total_lag += lag
+        self._max_lag = max(self._max_lag, lag)
+        self._sent += 1
+
+    def _finish(self, now):
+        elapsed = now - self._start
+        self.report = {
+            "sent": self._sent,
+            "seconds": elapsed,
+            "target_rate": self.rate,
+            "rate": (self._sent / elapsed) if elapsed else None,
+            "mean_lag": (self._total_lag / self._sent) if self._sent else 0,
+            "max_lag": self._max_lag,
+        }
+        logger.info(
+            "OutRate sent %(sent)s messages in %(seconds).3fs "
+            "(target %(target_rate)s/s) ; schedule lag: "
+            "mean = %(mean_lag).6fs max = %(max_lag).6fs", self.report)
+        self._start = None
+        self.deadline = None
+
+    def __repr__(self):
+        return "{%s | message: %s ; rate: %s}" % (
+            self.yaml_tag,
+            str(self.message.yaml_tag),
+            str(self.rate))
+
 
 class Equal(yaml.YAMLObject):
     """To be used in YAML.
@@ -291,20 +669,19 @@ class Equal(yaml.YAMLObject):
         if (values_count < 2):
             raise Exception(
                 "Only {} value(s) found but 2 expected.".format(values_count))
+        self._values = [repository.compile(value) for value in self.values]
 
     def step(self, *args):
-        logger = logging.getLogger(__name__)
-        logger.info(THREAD + "Equal.step")
+        logger.info("Equal.step")
         reference = None
         all_equal = True
-        for value in self.values:
-            value = self._repository.expand(value)
+        for value in self._values:
+            value = self._repository.evaluate(value)
             if (reference is None):
                 reference = value
             else:
                 if (reference != value):
-                    logger.warning(
-                        THREAD + "Values differ: " + str(reference) + " " + str(value))
+                    logger.warning("Values differ: %s %s", reference, value)
                     all_equal = False
                     break
         return (all_equal, True)
@@ -327,19 +704,20 @@ class Absent(yaml.YAMLObject):
         if (values_count < 2):
             raise Exception(
                 "Only {} value(s) found but 2 expected.".format(values_count))
+        self._values = [repository.compile(value) for value in self.values]
 
     def step(self, *args):
-        logger = logging.getLogger(__name__)
-        logger.info(THREAD + "Absent.step")
+        logger.info("Absent.step")
         reference = None
         absent = True
-        for value in self.values:
-            value = self._repository.expand(value)
+        for value in self._values:
+            value = self._repository.evaluate(value)
             if (reference is None):
                 reference = value
             else:
                 if (value in reference):
-                    logger.warning(THREAD + "Absent not verified:", reference, value)
+                    logger.warning(
+                        "Absent not verified: %s %s", reference, value)
                     absent = False
                     break
         return (absent, True)
@@ -348,6 +726,74 @@ class Absent(yaml.YAMLObject):
         return "{Absent | %s}" % str(self.values)
 
 
+class Percentile(yaml.YAMLObject):
+    """To be used in YAML.
+
+    Class to assert that a percentile of the latencies measured so far is
+    below some milliseconds. `message` is either a pair of message types
+    (`Hello->Welcome`) or the type of the messages received (`Welcome`,
+    after any message sent) and `thread` limits the latencies to those of
+    a thread.
+    """
+
+    yaml_tag = u'!Percentile'
+
+    def build(self, repository, in_socket, out_socket):
+        self._recorder = repository.timing.recorder
+        if (self._recorder is None):
+            raise Exception("Percentile needs the latencies to be recorded.")
+        if (not 0 < self.percentile <= 100):
+            raise Exception(
+                "Percentile must be in ]0, 100], not {}.".format(
+                    self.percentile))
+        self._thread = getattr(self, "thread", None)
+        self._message = getattr(self, "message", None)
+        if (self._thread is not None) and (self._message is not None):
+            # the pairs of messages are not kept by thread
+            raise Exception("Percentile takes either thread or message.")
+
+    def _histogram(self):
+        """Histogram of the latencies the step is about."""
+        histogram = latency.Histogram()
+        if (self._thread is not None):
+            other = self._recorder.by_thread.get(self._thread)
+            if (other is not None):
+                histogram.merge(other)
+            return histogram
+        for exchange, other in self._recorder.by_message.items():
+            if ((self._message is None) or
+                    (exchange == self._message) or
+                    (exchange.endswith("->" + self._message))):
+                histogram.merge(other)
+        return histogram
+
+    def step(self, *args):
+        logger.info("Percentile.step")
+        value = self._histogram().percentile(self.percentile)
+        if (value is None):
+            logger.warning("No latency measured for %s", self._describe())
+            return (False, True)
+        logger.info(
+            "p%s of %s = %.3f ms", self.percentile, self._describe(),
+            value / 1e6)
+        if (value >= self.below * 1e6):
+            logger.warning(
+                "p%s of %s is %.3f ms (below %s ms expected)",
+                self.percentile, self._describe(), value / 1e6, self.below)
+            return (False, True)
+        return (True, True)
+
+    def _describe(self):
+        thread = getattr(self, "thread", None)
+        if (thread is not None):
+            return "thread " + thread
+        return getattr(self, "message", None) or "all the messages"
+
+    def __repr__(self):
+        return "{Percentile | p%s of %s < %s ms}" % (
+            self.percentile, self._describe(), self.below)
+
+
 class CaptureConverter(object):
     """Converts the format of yaml2protobuf.CaptureXXX.captured.
 
@@ -359,9 +805,7 @@ class CaptureConverter(object):
     def __init__(self, capture_list, destination=None, raw=None):
         self._values = {}
         self.raw = raw
-        logger = logging.getLogger(__name__)
-        logger.debug(THREAD + "capture_list")
-        logger.debug(THREAD + str(capture_list))
+        logger.debug("capture_list = %s", capture_list)
         for dico in capture_list:
             for key, value in dico.items():
                 if (key in self._values):
@@ -381,101 +825,315 @@ class CaptureConverter(object):
                 "'CaptureConverter' object has no attribute '%s'" % attribute)
 
 
+class CaptureRecord(object):
+    """Compact replacement of CaptureConverter.
+
+    The subclasses (see record_class) only have slots for the values used by
+    the expressions of a thread; the other values (and the raw protobuf
+    message unless `raw` is used) are not kept.
+    """
+
+    __slots__ = ()
+    _fields = frozenset()
+
+    def __init__(self, capture_list, destination=None, raw=None):
+        fields = self._fields
+        for dico in capture_list:
+            for key, value in dico.items():
+                if (key in fields):
+                    setattr(self, key, value)
+        if ((destination is not None) and ("destination" in fields)):
+            self.destination = destination
+        if ("raw" in fields):
+            self.raw = raw
+
+
+# fields -> subclass of CaptureRecord
+_RECORD_CLASSES = {}
+
+
+def record_class(fields):
+    """Subclass of CaptureRecord keeping only the given fields."""
+    fields = frozenset(fields)
+    cls = _RECORD_CLASSES.get(fields)
+    if (cls is None):
+        # named like CaptureConverter for the same error messages
+        cls = type(
+            "CaptureConverter",
+            (CaptureRecord,),
+            {"__slots__": tuple(sorted(fields)), "_fields": fields})
+        _RECORD_CLASSES[fields] = cls
+    return cls
+
+
 class CaptureRepository(object):
     """Deals with values extracted from captures in received messages.
 
-    Warning: there is an unsafe eval performed.
+    The expressions are compiled once (see the expression module) and
+    evaluated in a namespace holding the whitelisted functions, the
+    variables and the messages received by type. The messages are kept in
+    CaptureHistory objects following the retention policies (see
+    set_retention). Unless everything is retained, the messages are stored
+    as CaptureRecord objects with only the values used by the expressions.
     """
 
-    eval_regexp = re.compile(r'\{[^{].*[^}]\}')
-
-    def __init__(self):
-        self._values_from_received_messages = collections.defaultdict(list)
+    def __init__(self, timing=None):
+        # message type -> CaptureHistory
+        self._values_from_received_messages = {}
+        self._retention = retention.Retention()
+        # message type -> indices used by the expressions (None if any)
+        self._references = {}
+        # message type -> attributes used by the expressions (None if any)
+        self._attributes = {}
+        # message type -> class storing the messages received
+        self._record_classes = {}
+        if (timing is None):
+            timing = latency.ThreadLatency(None)
+        # when messages were sent and received by the thread
+        self.timing = timing
+        # names available in expressions (the lists of received messages
+        # are added when an expression needs them)
+        self._namespace = dict(expression.FUNCTIONS)
+        self._namespace["__builtins__"] = {}
+
+    def set_variable(self, name, value):
+        self._namespace[name] = value
 
     def add_received_message(self, message):
         # message is of type CaptureXXX
-        # print("CaptureRepository::add_received_message(" + str(type(message)) + "@" + str(hex(id(message)))) + ")"
-        capture_converter = CaptureConverter(
+        capture_converter = self._record_classes.get(
+            message.message_type, CaptureConverter)(
                 message.captured,
                 message.destination,
                 message.raw)
-        # print("capture_converter = " + str(capture_converter))
-        self._values_from_received_messages[message.message_type].append(
-            capture_converter)
+        self._history(message.message_type).append(capture_converter)
+
+    def _history(self, message_type):
+        history = self._values_from_received_messages.get(message_type)
+        if (history is None):
+            history = retention.CaptureHistory()
+            self._configure_history(message_type, history)
+            self._values_from_received_messages[message_type] = history
+        return history
+
+    def _configure_history(self, message_type, history):
+        policy = self._retention.policy(message_type)
+        if (policy.referenced):
+            indices = self._references.get(message_type, ())
+            if (indices is None):
+                history.configure()
+            else:
+                first = max([index + 1 for index in indices if index >= 0],
+                            default=0)
+                last = max([-index for index in indices if index < 0],
+                           default=0)
+                history.configure(first, last)
+        else:
+            history.configure(last=policy.last, seconds=policy.seconds)
+        fields = self._attributes.get(message_type, ())
+        if ((policy is retention.ALL) or (fields is None)):
+            self._record_classes.pop(message_type, None)
+        else:
+            self._record_classes[message_type] = record_class(fields)
+
+    def set_retention(self, value, default=retention.ALL):
+        """Apply the retention policies (see the retention module) once the
+        expressions are compiled (and before any message is received)."""
+        self._retention = retention.Retention(value, default)
+        for message_type, history in (
+                self._values_from_received_messages.items()):
+            self._configure_history(message_type, history)
+
+    def compile(self, value):
+        """Compile value (see expression.parse) and check the names it
+        uses are known."""
+        compiled = expression.parse(value)
+        for name in compiled.names:
+            if (name in self._namespace):
+                continue
+            if (yaml2protobuf.get_message_type(name) is None):
+                raise Exception(
+                    "Unknown name '{}' in expression '{}'.".format(
+                        name, value))
+            self._namespace[name] = self._history(name)
+        CaptureRepository._merge(
+            self._references, compiled.indices, self._namespace)
+        CaptureRepository._merge(
+            self._attributes, compiled.attributes, self._namespace)
+        return compiled
+
+    @staticmethod
+    def _merge(usage, new_usage, namespace):
+        """Merge the indices or attributes used by an expression."""
+        for name, values in new_usage.items():
+            if (isinstance(namespace.get(name), retention.CaptureHistory)):
+                known = usage.setdefault(name, set())
+                if (known is not None):
+                    if (values is None):
+                        usage[name] = None
+                    else:
+                        known.update(values)
+
+    def evaluate(self, compiled):
+        """Evaluate a value returned by compile."""
+        with profiling.section("expand"):
+            return compiled.evaluate(self._namespace)
 
     def expand(self, string):
-        logger = logging.getLogger(__name__)
-        logger.debug(THREAD + "string = '" + repr(string) + "'")
-        logger.debug(THREAD + "type(string) = '" + str(type(string)) + "'")
-        if ((isinstance(string, str)) and
-                (CaptureRepository.eval_regexp.match(string))):
-            string_without_brackets = string[1:-1]
-            logger.debug(
-                THREAD + "string_without_brackets = '" + string_without_brackets + "'")
-            value = str(eval(
-                string_without_brackets,
-                self._values_from_received_messages))
-            logger.debug(THREAD + "expanded string to value='" + value + "'")
-        else:
-            value = string
-            logger.debug(THREAD + "copied string to value='" + str(value) + "'")
-        return value
+        return self.compile(string).evaluate(self._namespace)
+
+
+class Replica(object):
+    """Values specific to one instance of a replicated thread.
+
+    Available in expressions as Replica (like {Replica.robot_id}).
+    """
+
+    def __init__(self, name, index, count):
+        self.index = index
+        self.count = count
+        self.robot_id = "{}_{}".format(name.replace(" ", "_"), index)
+        self.temporary_id = uuid.uuid4().hex
+
+    def __repr__(self):
+        return "{Replica | %i/%i}" % (self.index, self.count)
 
 
 class Thread(yaml.YAMLObject):
     """To be used in YAML.
 
     Class to describe a succession of steps to be executed in sequence.
+    With `replicas: N` the thread is instantiated N times (see replicate).
     """
 
     yaml_tag = u'!Thread'
     max_name_len = 0
 
-    def build(self, zmq_context):
-        self.in_socket.build(zmq_context)
-        self.out_socket.build(zmq_context)
-        self._repository = CaptureRepository()
+    def replicate(self):
+        """Create the instances of the thread (as many as `replicas`)."""
+        count = getattr(self, "replicas", 1)
+        if ((not isinstance(count, int)) or isinstance(count, bool) or
+                (count < 1)):
+            raise Exception(
+                "Replicas must be a positive integer, not {}.".format(count))
+        if (1 == count):
+            self.replica = Replica(self.name, 0, 1)
+            return [self]
+        threads = []
+        for index in range(count):
+            thread = copy.copy(self)
+            thread.name = "{}#{}".format(self.name, index)
+            thread.replica = Replica(self.name, index, count)
+            thread.in_socket = self.in_socket.replicate(index)
+            thread.out_socket = self.out_socket.replicate(index)
+            # the steps hold the state of the thread so they cannot be
+            # shared (the messages can)
+            thread.flow = [copy.copy(element) for element in self.flow]
+            threads.append(thread)
+        return threads
+
+    def build(self, socket_pool, latency_recorder=None, asynchronous=False):
+        self.in_socket.build(socket_pool, asynchronous)
+        self.out_socket.build(socket_pool, asynchronous)
+        self._repository = CaptureRepository(
+            latency.ThreadLatency(self.name, latency_recorder))
+        if (not hasattr(self, "replica")):
+            self.replica = Replica(self.name, 0, 1)
+        self._repository.set_variable("Replica", self.replica)
         for element in self.flow:
             element.build(self._repository, self.in_socket, self.out_socket)
+        # looping threads only keep what their expressions need by default
+        self._repository.set_retention(
+            getattr(self, "retention", None),
+            retention.REFERENCED if self.loop else retention.ALL)
         if (not hasattr(self, "index")):
             self.index = 0
         self._skipped = False
         if (len(self.name) > Thread.max_name_len):
             Thread.max_name_len = len(self.name)
 
+    @property
+    def _prefix(self):
+        """Prefix of the messages logged by the thread."""
+        # computed on the first step, once all the threads are built
+        prefix = self.__dict__.get("_log_prefix")
+        if (prefix is None):
+            prefix = "{:<{:}} | ".format(self.name, Thread.max_name_len)
+            self._log_prefix = prefix
+        return prefix
+
     def step(self):
-        logger = logging.getLogger(__name__)
-        global THREAD
-        THREAD = "{:<{:}} | ".format(self.name, Thread.max_name_len)
+        log.set_thread_prefix(self._prefix)
         if (self.has_more_steps):
-            logger.debug(THREAD + "In thread '{name}' at step {index}".format(
-                name=self.name, index=self.index))
-            result, inc = self.flow[self.index].step()
             logger.debug(
-                THREAD + "In thread '{name}': "
-                "index = {index} ; result = {result} ; inc = {inc}".format(
-                    name=self.name,
-                    index=self.index,
-                    result=repr(result),
-                    inc=inc))
-            if (result is not None and not result):
-                error_message = "Failure at index {} in thread '{}'.".format(
-                        self.index, self.name)
-                raise Exception(error_message)
-            if (inc):
-                self.index = (self.index + 1)
-                if (self.loop):
-                    self.index %= len(self.flow)
+                "In thread '%s' at step %i", self.name, self.index)
+            element = self.flow[self.index]
+            profiling.set_step(self.name, self.index, element)
+            with profiling.section("step"):
+                result, inc = element.step()
+            self._advance(result, inc)
         else:
             if (not self._skipped):
-                logger.info(THREAD + "Skipped thread '{name}'".format(
-                    name=self.name))
+                logger.info("Skipped thread '%s'", self.name)
                 self._skipped = True
 
+    async def run_async(self):
+        """Run all the steps as a coroutine (used by the asyncio scheduler).
+        """
+        # each task has its own context
+        log.set_thread_prefix(self._prefix)
+        while (self.has_more_steps):
+            element = self.flow[self.index]
+            step_async = getattr(element, "step_async", None)
+            profiling.set_step(self.name, self.index, element)
+            with profiling.section("step"):
+                if (step_async is None):
+                    result, inc = element.step()
+                else:
+                    result, inc = await step_async()
+            self._advance(result, inc)
+
+    def _advance(self, result, inc):
+        logger.debug(
+            "In thread '%s': index = %i ; result = %r ; inc = %s",
+            self.name, self.index, result, inc)
+        if (result is not None and not result):
+            error_message = "Failure at index {} in thread '{}'.".format(
+                    self.index, self.name)
+            raise Exception(error_message)
+        if (inc):
+            self.index = (self.index + 1)
+            if (self.loop):
+                self.index %= len(self.flow)
+
     @property
     def has_more_steps(self):
         return (self.index < len(self.flow))
 
+    @property
+    def waiting_socket(self):
+        """Socket the current step is waiting on (None if not waiting)."""
+        if (self.has_more_steps and
+                getattr(self.flow[self.index], "waits_for_message", False)):
+            return self.in_socket
+        return None
+
+    @property
+    def deadline(self):
+        """Time (as in time.monotonic()) before which the current step
+        has nothing to do (None if it may progress now)."""
+        if (self.has_more_steps):
+            return getattr(self.flow[self.index], "deadline", None)
+        return None
+
+    @property
+    def expiry(self):
+        """Time (as in time.monotonic()) at which the current step fails
+        if it is still waiting (None if it may wait forever)."""
+        if (self.has_more_steps):
+            return getattr(self.flow[self.index], "expiry", None)
+        return None
+
     def __repr__(self):
         return "{Thread | in_socket = %s ; out_socket = %s ; flow = %s}" % (
             str(self.in_socket),
@@ -492,50 +1150,295 @@ class Scenario(object):
     This is implemented as a context manager.
     """
 
-    def __init__(self, yaml_content):
-        self._data = yaml.load(yaml_content, Loader=yaml.FullLoader)
+    SCHEDULERS = ("polling", "events", "asyncio")
+
+    def __init__(
+            self,
+            yaml_content,
+            scheduler="polling",
+            poll_timeout=None,
+            processes=1,
+            warmup=0,
+            cache_dir=None,
+            record=None,
+            profile=False,
+            socket_pool=None,
+            io_threads=None):
+        """
+        `scheduler` is one of:
+         - "polling": each step visits every thread in turn, waiting a bit
+           on each socket.
+         - "events": all the sockets are polled at once and only the
+           threads that can progress are stepped.
+         - "asyncio": each thread runs as a coroutine over zmq.asyncio
+           sockets; a single call to step runs the whole scenario.
+        `poll_timeout` is the maximum time in milliseconds a step waits
+        for an event with the "events" scheduler (None means forever).
+        `processes` is the number of worker processes the threads are
+        spread over (1 means everything runs in the current process).
+        `warmup` is the number of seconds during which latencies are not
+        recorded.
+        `cache_dir` is the directory where the parsed scenario files are
+        cached (None disables the cache).
+        `record` is the path of a file where the frames sent and received
+        are recorded (see the recording module).
+        With `profile` the time spent in each step is measured (see the
+        profiling module and profiler).
+        `socket_pool` is a pool.SocketPool shared with other scenarios (to
+        reuse its connections) that is left open at the end; by default
+        the scenario has its own pool, closed at the end.
+        `io_threads` is the number of I/O threads of the zmq context of
+        the scenario (None means the `io_threads` of the YAML content or 1).
+        """
+        if (scheduler not in Scenario.SCHEDULERS):
+            raise Exception("Unknown scheduler: '{}'".format(scheduler))
+        if (record is not None) and (processes > 1):
+            raise Exception("Cannot record with several processes.")
+        self._record = record
+        self._recorder = None
+        self._yaml_content = yaml_content
+        self._processes = processes
+        self._pool = None
+        self._warmup = warmup
+        self._cache_dir = cache_dir
+        self._latency = latency.LatencyRecorder(warmup)
+        self._profiler = profiling.Profiler() if profile else None
+        self._data = loading.load(yaml_content, cache_dir)
         self._messages = self._data["messages"]
-        self._zmq_context = zmq.Context()
-        self._threads = self._data["threads"]
+        if (io_threads is None):
+            io_threads = self._data.get("io_threads", 1)
+        self._io_threads = io_threads
+        if ("asyncio" == scheduler):
+            # older pyzmq attach the sockets to the current loop when they
+            # are created so the loop must exist before the build
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+        else:
+            self._loop = None
+        self._owns_socket_pool = (socket_pool is None)
+        if (self._owns_socket_pool):
+            socket_pool = pool.SocketPool(io_threads)
+        self._socket_pool = socket_pool
+        self._threads = [
+            replica
+            for thread in self._data["threads"]
+            for replica in thread.replicate()]
+        self._scheduler = scheduler
+        self._poll_timeout = poll_timeout
+        self._poller = None
+        self._polled_sockets = set()
+
+    def select_threads(self, indices):
+        """Only keep the threads at the given indices (before build)."""
+        self._threads = [self._threads[index] for index in indices]
 
     def build(self):
+        if (self._processes > 1):
+            self._pool = parallel.ProcessPool(
+                self._yaml_content,
+                parallel.partition(self._threads, self._processes),
+                self._scheduler,
+                self._warmup,
+                self._latency,
+                self._cache_dir,
+                self._profiler,
+                self._io_threads)
+            self._pool.start()
+            return
+        if (self._profiler is not None):
+            profiling.start(self._profiler)
         for thread in self._threads:
-            thread.build(self._zmq_context)
+            thread.build(
+                self._socket_pool,
+                self._latency,
+                "asyncio" == self._scheduler)
+        if (self._record is not None):
+            self._recorder = recording.Recorder(self._record)
+            for thread in self._threads:
+                thread.in_socket.recorder = self._recorder
+                thread.out_socket.recorder = self._recorder
+        if ("events" == self._scheduler):
+            self._poller = zmq.Poller()
+            # the poller tells us when to read so recv must not wait
+            for thread in self._threads:
+                thread.in_socket.poll_timeout = 0
 
     def step(self):
+        if (self._pool is not None):
+            self._pool.wait()
+        elif ("events" == self._scheduler):
+            self._step_on_events()
+        elif ("asyncio" == self._scheduler):
+            self._loop.run_until_complete(self._run_async())
+        else:
+            self._step_all_threads()
+
+    async def _run_async(self):
+        tasks = [asyncio.ensure_future(thread.run_async())
+                 for thread in self._threads]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # a failure in one thread stops the others
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _step_all_threads(self):
+        # do not spin when all the threads are sleeping
+        deadlines = []
+        for thread in self._threads:
+            if (not thread.has_more_steps):
+                continue
+            deadline = thread.deadline
+            if (deadline is None):
+                deadlines = []
+                break
+            deadlines.append(deadline)
+        if (deadlines):
+            time.sleep(max(0, min(deadlines) - time.monotonic()))
+        for thread in self._threads:
+            thread.step()
+
+    def _step_on_events(self):
+        """Step the threads that can progress, blocking until one can."""
+        now = time.monotonic()
+        runnable = []
+        waiting = []
+        deadlines = []
         for thread in self._threads:
+            if (not thread.has_more_steps):
+                continue
+            deadline = thread.deadline
+            if (deadline is not None) and (now < deadline):
+                deadlines.append(deadline)
+            elif (thread.waiting_socket is None):
+                runnable.append(thread)
+            else:
+                waiting.append(thread)
+                expiry = thread.expiry
+                if (expiry is not None):
+                    # wake up to fail the step if nothing arrives
+                    deadlines.append(expiry)
+        for thread in runnable:
             thread.step()
+        if (runnable):
+            # other threads may have more to do right now
+            timeout = 0
+        else:
+            timeout = self._poll_timeout
+            if (deadlines):
+                # milliseconds until the first sleeping thread wakes up
+                until_deadline = max(
+                    0, int(math.ceil((min(deadlines) - now) * 1000)))
+                if (timeout is None) or (until_deadline < timeout):
+                    timeout = until_deadline
+        if (not waiting):
+            if (timeout):
+                time.sleep(timeout / 1000.0)
+            return
+        self._update_poller(
+            {thread.waiting_socket.zmq_socket for thread in waiting})
+        events = dict(self._poller.poll(timeout))
+        now = time.monotonic()
+        for thread in waiting:
+            expiry = thread.expiry
+            if ((events.get(thread.waiting_socket.zmq_socket, 0) & zmq.POLLIN)
+                    or ((expiry is not None) and (now >= expiry))):
+                thread.step()
+
+    def _update_poller(self, zmq_sockets):
+        # only the sockets somebody waits on are registered, otherwise
+        # pending messages nobody reads yet would wake us up for nothing
+        for zmq_socket in self._polled_sockets - zmq_sockets:
+            self._poller.unregister(zmq_socket)
+        for zmq_socket in zmq_sockets - self._polled_sockets:
+            self._poller.register(zmq_socket, zmq.POLLIN)
+        self._polled_sockets = zmq_sockets
 
     def step_all(self):
         while (self.has_more_steps):
             self.step()
 
+    @property
+    def latency(self):
+        """LatencyRecorder with the latencies measured so far."""
+        return self._latency
+
+    @property
+    def profiler(self):
+        """profiling.Profiler with the times measured so far (None if not
+        profiling)."""
+        return self._profiler
+
+    @property
+    def send_counts(self):
+        """Number of messages sent, of sends that waited and of messages
+        dropped by endpoint (only for the threads of this process)."""
+        counts = {}
+        wrappers = {
+            id(thread.out_socket): thread.out_socket
+            for thread in self._threads}
+        for wrapper in wrappers.values():
+            total = counts.setdefault(
+                wrapper.connection_string,
+                {"sent": 0, "blocked": 0, "dropped": 0})
+            for name, value in getattr(wrapper, "send_counts", {}).items():
+                total[name] += value
+        return counts
+
     @property
     def has_more_steps(self):
+        if (self._pool is not None):
+            return self._pool.running
         return any((thread.has_more_steps for thread in self._threads))
 
     def __enter__(self):
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        # nothing special to do when leaving the context manager
-        pass
+        if (self._pool is not None):
+            self._pool.terminate()
+        if (self._recorder is not None):
+            self._recorder.close()
+        if (self._profiler is not None):
+            profiling.stop()
+        self._socket_pool.release()
+        if (self._loop is not None):
+            self._loop.close()
+            asyncio.set_event_loop(None)
+        if (self._owns_socket_pool):
+            self._socket_pool.close()
+
 
 class Sleep(yaml.YAMLObject):
     """To be used in YAML.
 
     Class to sleep for a given amount of seconds.
+    The thread is parked until the deadline is reached but the other
+    threads keep running.
     """
 
     yaml_tag = u'!Sleep'
 
     def build(self, repository, in_socket, out_socket):
-        pass
+        # time.monotonic() value at which the sleep ends (None when the
+        # step is not running)
+        self.deadline = None
 
     def step(self, *args):
-        logger = logging.getLogger(__name__)
-        logger.info(THREAD + "Sleep.step")
-        time.sleep(self.seconds)
+        now = time.monotonic()
+        if (self.deadline is None):
+            logger.info("Sleep.step")
+            self.deadline = now + self.seconds
+        if (now < self.deadline):
+            return (None, False)
+        self.deadline = None
+        return (None, True)
+
+    async def step_async(self):
+        logger.info("Sleep.step")
+        await asyncio.sleep(self.seconds)
         return (None, True)
 
     def __repr__(self):
@@ -554,24 +1457,24 @@ class UserInput(yaml.YAMLObject):
         pass
 
     def step(self, *args):
-        logger = logging.getLogger(__name__)
-        logger.info(THREAD + "UserInput.step")
+        logger.info("UserInput.step")
         input(self.text)
         return (None, True)
 
+    async def step_async(self):
+        # input blocks so it must not run in the event loop
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.step)
+
     def __repr__(self):
         return "{UserInput}"
 
 
-def configure_logging(verbose):
-    logger = logging.getLogger(__name__)
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-            '%(asctime)s %(name)-12s %(lineno)4d %(levelname)-8s %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    if (verbose):
-        logger.setLevel(logging.DEBUG)
-    else:
-        logger.setLevel(logging.INFO)
-    yaml2protobuf.configure_logging(verbose)
+def configure_logging(verbose, asynchronous=True):
+    """Log to stderr (through a background thread if asynchronous, see
+    log.configure)."""
+    loggers = [
+        logging.getLogger(__name__),
+        logging.getLogger(recording.__name__),
+        logging.getLogger(yaml2protobuf.__name__)]
+    log.configure(loggers, verbose, asynchronous)
@@ -0,0 +1,64 @@
+from nose.tools import assert_equal
+import os
+import tempfile
+import unittest
+import orwell.shooter.batch as batch
+import orwell.shooter.test.helpers as helpers
+
+CONNECTED = """
+messages: []
+
+sockets:
+    - !SocketPush &push
+        port: 9000
+        address: 192.168.1.1
+
+threads: []
+"""
+
+
+class BatchTest(unittest.TestCase):
+    @staticmethod
+    def test_remap_ports():
+        yaml_content = helpers.round_trip(9000, ["remapped"])
+        remapped, ports = batch.remap_ports(yaml_content)
+        assert_equal([9000], list(ports))
+        assert_equal(
+            yaml_content.replace("port: 9000", "port: {}".format(ports[9000])),
+            remapped)
+        # the port of a server outside of the scenario is kept
+        assert_equal((CONNECTED, {}), batch.remap_ports(CONNECTED))
+
+    @staticmethod
+    def test_run():
+        with tempfile.TemporaryDirectory() as directory:
+            # the same fixed port in every file
+            contents = {
+                "first.yml": helpers.round_trip(9000, ["first"]),
+                "second.yaml": helpers.round_trip(9000, ["second"]),
+                "third.yml": helpers.round_trip(9000, ["third"]),
+                "failed.yml": helpers.round_trip(9000, ["one"]).replace(
+                    '- "one"', '- "other"'),
+                "stuck.yml": helpers.round_trip(9000, ["stuck"], send=False),
+                "ignored.txt": "",
+            }
+            for name, content in contents.items():
+                with open(os.path.join(directory, name), "w") as output:
+                    output.write(content)
+            runner = batch.BatchRunner([directory], jobs=2, timeout=5)
+            assert_equal(
+                ["failed.yml", "first.yml", "second.yaml", "stuck.yml",
+                 "third.yml"],
+                [os.path.basename(path) for path in runner.files])
+            reports = runner.run()
+        assert_equal(
+            [batch.FAILED, batch.PASSED, batch.PASSED, batch.TIMEOUT,
+             batch.PASSED],
+            [report["status"] for report in reports])
+        assert_equal(
+            "Failure at index 2 in thread 'round trip'.",
+            reports[0]["error"])
+        assert_equal("Timeout after 5 seconds.", reports[3]["error"])
+        lines = batch.format_report(reports, 6)
+        assert_equal(
+            "3 passed, 1 failed, 1 timed out in 6.00 s", lines[-1])
@@ -0,0 +1,71 @@
+from nose.tools import assert_equal
+import unittest
+import orwell.shooter.expression as expression
+
+
+class Value(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class ExpressionTest(unittest.TestCase):
+    @staticmethod
+    def _evaluate(text, **names):
+        namespace = dict(expression.FUNCTIONS)
+        namespace["__builtins__"] = {}
+        namespace.update(names)
+        return expression.parse(text).evaluate(namespace)
+
+    @staticmethod
+    def test_literal():
+        for value in ("text", "{{escaped}}", 42, None):
+            compiled = expression.parse(value)
+            assert_equal((), compiled.names)
+            assert_equal(value, compiled.evaluate({}))
+
+    @staticmethod
+    def test_evaluate():
+        hello = [Value(name="first"), Value(name="last")]
+        assert_equal(
+            "last", ExpressionTest._evaluate("{Hello[-1].name}", Hello=hello))
+        assert_equal(
+            "2", ExpressionTest._evaluate("{len(Hello)}", Hello=hello))
+        assert_equal(
+            "1", ExpressionTest._evaluate("{len(Hello[1:])}", Hello=hello))
+        assert_equal(
+            frozenset(("len", "Hello")),
+            expression.parse("{len(Hello)}").names)
+
+    @staticmethod
+    def test_usage():
+        compiled = expression.parse(
+            "{max(Hello[0].name, Pong[-2].raw, len(Ping))}")
+        assert_equal({"Hello": {0}, "Pong": {-2}, "Ping": set()},
+                     compiled.indices)
+        assert_equal({"Hello": {"name"}, "Pong": {"raw"}},
+                     compiled.attributes)
+        compiled = expression.parse("{sorted(Hello[1:])}")
+        assert_equal({"Hello": None}, compiled.indices)
+        assert_equal({"Hello": None}, compiled.attributes)
+
+    @staticmethod
+    def test_compiled_once():
+        assert(expression.parse("{Hello[0].name}")
+               is expression.parse("{Hello[0].name}"))
+
+    @staticmethod
+    def test_forbidden():
+        for text in (
+                "{Hello[0].__class__}",
+                "{__import__('os')}",
+                "{open('/etc/passwd')}",
+                "{Hello + Hello}",
+                "{[x for x in Hello]}",
+                "{lambda: 0}",
+                "{Hello[0}"):
+            try:
+                expression.parse(text)
+                thrown = False
+            except Exception as exception:
+                thrown = (text in str(exception))
+            assert thrown, text
@@ -0,0 +1,75 @@
+"""Scenario shared by several tests."""
+
+import re
+import socket
+
+ROUND_TRIP_HEADER = """
+messages:
+    - hello: !CaptureHello &hello
+        destination: TEST1
+        message:
+            name: "{{player_name}}"
+
+sockets:
+    - !SocketPull &pull
+        port: {port}
+        bind: yes
+    - !SocketPush &push
+        port: {port}
+
+threads:
+    - !Thread
+        name: "{name}"
+        loop: False
+        in_socket: *pull
+        out_socket: *push
+        flow:
+"""
+
+ROUND_TRIP_OUT = """
+            - !Out
+                message: *hello
+                arguments:
+                    player_name: "{player_name}"
+"""
+
+ROUND_TRIP_IN = """
+            - !In
+                message: *hello
+            - !Equal
+                values:
+                    - "{player_name}"
+                    - "{{Hello[-1].player_name}}"
+"""
+
+
+def free_port():
+    """TCP port nobody listens on (to be bound right away)."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def round_trip(port, player_names, name="round trip", send=True):
+    """Scenario of a thread sending Hello messages to itself.
+
+    For each player name the thread sends a Hello (unless send is False, to
+    receive what something else sends), receives it and checks the name.
+    """
+    content = ROUND_TRIP_HEADER.format(port=port, name=name)
+    for player_name in player_names:
+        if (send):
+            content += ROUND_TRIP_OUT.format(player_name=player_name)
+        content += ROUND_TRIP_IN.format(player_name=player_name)
+    return content
+
+
+def portless(yaml_content, protocol="inproc", prefix="endpoint_"):
+    """Replace the ports of the sockets of yaml_content by inproc (or ipc)
+    endpoints named after the ports (the prefix of an ipc endpoint is a
+    directory path)."""
+    return re.sub(
+        r"^( *)port: (\d+)$",
+        r'\1protocol: {}\n\1address: "{}\2"'.format(protocol, prefix),
+        yaml_content,
+        flags=re.MULTILINE)
@@ -0,0 +1,60 @@
+from nose.tools import assert_equal
+import unittest
+import orwell.shooter.latency as latency
+
+
+class HistogramTest(unittest.TestCase):
+    @staticmethod
+    def test_percentiles():
+        histogram = latency.Histogram()
+        assert_equal(None, histogram.percentile(50))
+        for value in range(1, 1001):
+            histogram.record(value * 1000)
+        assert_equal(1000, histogram.count)
+        assert_equal(1000, histogram.min)
+        assert_equal(1000000, histogram.max)
+        for percent in (50, 90, 99):
+            expected = percent * 10000
+            value = histogram.percentile(percent)
+            # buckets have a relative width of 1/32
+            assert(expected <= value <= expected * (1 + 1 / 32.0))
+        assert_equal(1000000, histogram.percentile(100))
+
+    @staticmethod
+    def test_merge():
+        first = latency.Histogram()
+        second = latency.Histogram()
+        for value in (1, 2, 3):
+            first.record(value)
+        for value in (10, 20):
+            second.record(value)
+        first.merge(second)
+        assert_equal(5, first.count)
+        assert_equal(1, first.min)
+        assert_equal(20, first.max)
+        assert_equal(3, first.percentile(60))
+
+
+class LatencyRecorderTest(unittest.TestCase):
+    @staticmethod
+    def test_warmup():
+        recorder = latency.LatencyRecorder(warmup=3600)
+        probe = latency.ThreadLatency("thread", recorder)
+        probe.sent("Hello")
+        probe.received("Welcome")
+        assert_equal({}, recorder.report()["threads"])
+
+    @staticmethod
+    def test_matching():
+        recorder = latency.LatencyRecorder()
+        probe = latency.ThreadLatency("thread", recorder)
+        assert_equal(None, probe.received("Welcome"))
+        probe.sent("Hello")
+        assert(probe.received("Welcome") >= 0)
+        # a sent message is only matched once
+        assert_equal(None, probe.received("GameState"))
+        report = recorder.report()
+        assert_equal(["Hello->Welcome"], list(report["messages"].keys()))
+        assert_equal(1, report["threads"]["thread"]["count"])
+        # header, one thread and one pair of messages
+        assert_equal(3, len(recorder.format_report()))
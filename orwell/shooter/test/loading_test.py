@@ -0,0 +1,44 @@
+from nose.tools import assert_equal
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+import orwell.shooter.loading as loading
+import orwell.shooter.scenario as scen
+import orwell.shooter.test.helpers as helpers
+
+YAML_CONTENT = helpers.round_trip(helpers.free_port(), ["cached"], "cached")
+
+
+class LoadingTest(unittest.TestCase):
+    @staticmethod
+    def test_loader():
+        data = yaml.load(YAML_CONTENT, Loader=loading.ScenarioLoader)
+        thread = data["threads"][0]
+        assert(isinstance(thread, scen.Thread))
+        # aliases give the same objects
+        assert(thread.flow[0].message is thread.flow[1].message)
+        assert(thread.in_socket is data["sockets"][0])
+
+    @staticmethod
+    def test_cache():
+        cache_dir = tempfile.mkdtemp()
+        try:
+            data = loading.load(YAML_CONTENT, cache_dir)
+            files = os.listdir(cache_dir)
+            assert_equal(1, len(files))
+            cached = loading.load(YAML_CONTENT, cache_dir)
+            assert(cached is not data)
+            thread = cached["threads"][0]
+            assert_equal("cached", thread.name)
+            assert(thread.flow[0].message is thread.flow[1].message)
+            assert_equal(files, os.listdir(cache_dir))
+            # a broken cache is ignored
+            with open(os.path.join(cache_dir, files[0]), "wb") as broken:
+                broken.write(b"broken")
+            with scen.Scenario(YAML_CONTENT, cache_dir=cache_dir) as scenario:
+                scenario.build()
+                scenario.step_all()
+        finally:
+            shutil.rmtree(cache_dir)
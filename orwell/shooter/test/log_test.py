@@ -0,0 +1,31 @@
+from nose.tools import assert_equal
+import io
+import logging
+import unittest
+import orwell.shooter.log as log
+
+
+class Unprintable(object):
+    def __repr__(self):
+        raise Exception("repr must not be called")
+
+
+class LogTest(unittest.TestCase):
+    @staticmethod
+    def test_asynchronous():
+        stream = io.StringIO()
+        logger = logging.getLogger("orwell.shooter.test.log_test")
+        try:
+            log.configure([logger], False, stream=stream)
+            adapter = log.ThreadLoggerAdapter(logger)
+            log.set_thread_prefix("robot | ")
+            adapter.info("sent %i bytes", 12)
+            # below the level so never formatted
+            adapter.debug("payload %r", Unprintable())
+        finally:
+            log.set_thread_prefix("")
+            log.stop()
+        lines = stream.getvalue().splitlines()
+        assert_equal(1, len(lines))
+        assert(lines[0].endswith("robot | sent 12 bytes"))
+        assert_equal([], logger.handlers)
@@ -0,0 +1,42 @@
+from nose.tools import assert_equal
+import unittest
+import orwell.shooter.pool as pool
+import orwell.shooter.scenario as scen
+import orwell.shooter.test.helpers as helpers
+
+
+class PoolTest(unittest.TestCase):
+    @staticmethod
+    def test_close():
+        port = helpers.free_port()
+        yaml_content = helpers.round_trip(port, ["first", "second"])
+        # the port is free again as soon as a scenario is over
+        for _ in range(3):
+            with scen.Scenario(yaml_content) as scenario:
+                scenario.build()
+                scenario.step_all()
+                socket_pool = scenario._socket_pool
+                assert_equal(2, len(socket_pool))
+            assert_equal(0, len(socket_pool))
+            assert(socket_pool.zmq_context.closed)
+
+    @staticmethod
+    def test_shared():
+        yaml_content = helpers.round_trip(helpers.free_port(), ["shared"])
+        with pool.SocketPool() as socket_pool:
+            zmq_sockets = None
+            for scheduler in ("polling", "asyncio", "events", "asyncio"):
+                with scen.Scenario(
+                        yaml_content,
+                        scheduler=scheduler,
+                        socket_pool=socket_pool) as scenario:
+                    scenario.build()
+                    scenario.step_all()
+                    assert(not scenario.has_more_steps)
+                # the same connections are used by every scenario
+                if (zmq_sockets is None):
+                    zmq_sockets = dict(socket_pool._sockets)
+                assert_equal(zmq_sockets, socket_pool._sockets)
+                assert(not socket_pool.zmq_context.closed)
+        assert(socket_pool.zmq_context.closed)
+        assert(all(zmq_socket.closed for zmq_socket in zmq_sockets.values()))
@@ -0,0 +1,66 @@
+from nose.tools import assert_equal
+import unittest
+import orwell.shooter.profiling as profiling
+import orwell.shooter.scenario as scen
+import orwell.shooter.test.helpers as helpers
+
+YAML_CONTENT = helpers.round_trip(
+    helpers.free_port(), ["profiled"], "profiled")
+
+
+class ProfilingTest(unittest.TestCase):
+    @staticmethod
+    def test_inactive():
+        # nothing is measured outside of a profiled step
+        assert(profiling.section("send") is profiling.section("poll"))
+        profiler = profiling.Profiler()
+        profiling.start(profiler)
+        try:
+            with profiling.section("send"):
+                pass
+        finally:
+            profiling.stop()
+        assert_equal({}, profiler.steps)
+
+    @staticmethod
+    def test_scenario():
+        with scen.Scenario(YAML_CONTENT, profile=True) as scenario:
+            scenario.build()
+            scenario.step_all()
+        report = scenario.profiler.report()
+        assert_equal(
+            [("profiled", 0, "!Out Hello"),
+             ("profiled", 1, "!In Hello"),
+             ("profiled", 2, "!Equal")],
+            [(step["thread"], step["index"], step["step"])
+             for step in report])
+        out, received, equal = [step["sections"] for step in report]
+        assert_equal(
+            {"step", "expand", "encode", "send"}, set(out))
+        assert_equal(
+            {"step", "poll", "decode", "match"}, set(received))
+        assert_equal({"step", "expand"}, set(equal))
+        assert_equal(1, out["step"]["count"])
+        # the message may only arrive after a few polls
+        assert_equal(received["step"]["count"], received["poll"]["count"])
+        assert_equal(2, received["decode"]["count"])
+        assert(out["step"]["wall"] >= out["send"]["wall"])
+        lines = scenario.profiler.format_report()
+        assert_equal(4, len(lines))
+        assert("!In Hello" in lines[2])
+        # not profiled any more
+        assert(profiling.section("step") is profiling.section("poll"))
+
+    @staticmethod
+    def test_merge():
+        profiler = profiling.Profiler()
+        profiler.times(("a", 0), "step")[:] = [1, 0.5, 0.25]
+        profiler.labels[("a", 0)] = "!Out Hello"
+        other = profiling.Profiler()
+        other.times(("a", 0), "step")[:] = [2, 1.0, 0.5]
+        other.times(("b", 1), "poll")[:] = [3, 0.1, 0.1]
+        other.labels[("b", 1)] = "!In Hello"
+        profiler.merge(other)
+        assert_equal([3, 1.5, 0.75], profiler.steps[("a", 0)]["step"])
+        assert_equal([3, 0.1, 0.1], profiler.steps[("b", 1)]["poll"])
+        assert_equal("!In Hello", profiler.labels[("b", 1)])
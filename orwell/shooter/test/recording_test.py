@@ -0,0 +1,76 @@
+from nose.tools import assert_equal
+import os
+import shutil
+import tempfile
+import unittest
+import zmq
+import orwell.shooter.recording as recording
+import orwell.shooter.scenario as scen
+import orwell.shooter.test.helpers as helpers
+
+PORT = helpers.free_port()
+
+YAML_CONTENT = helpers.round_trip(PORT, ["first", "second"], "recorded")
+
+# receives what the replay of YAML_CONTENT sends
+REPLAYED_YAML_CONTENT = helpers.round_trip(
+    PORT, ["first", "second"], "replayed", send=False)
+
+
+class RecordingTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, "traffic.rec")
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _record(self):
+        with scen.Scenario(YAML_CONTENT, record=self._path) as scenario:
+            scenario.build()
+            scenario.step_all()
+
+    def test_record(self):
+        self._record()
+        records = list(recording.read(self._path))
+        sockets = [record for record in records
+                   if isinstance(record, recording.SocketRecord)]
+        frames = [record for record in records
+                  if isinstance(record, recording.FrameRecord)]
+        assert_equal(
+            [(zmq.PUSH, False, "tcp://127.0.0.1:{}".format(PORT)),
+             (zmq.PULL, True, "tcp://0.0.0.0:{}".format(PORT))],
+            [(record.zmq_type, record.bind, record.connection_string)
+             for record in sockets])
+        assert_equal(
+            [recording.SENT, recording.RECEIVED] * 2,
+            [frame.direction for frame in frames])
+        assert_equal({"TEST1"}, {frame.destination for frame in frames})
+        assert_equal({"Hello"}, {frame.message_type for frame in frames})
+        # what is received is what was sent
+        assert_equal(frames[0].payload, frames[1].payload)
+        assert(frames[0].payload != frames[2].payload)
+        timestamps = [frame.timestamp for frame in frames]
+        assert_equal(sorted(timestamps), timestamps)
+
+    def test_replay(self):
+        self._record()
+        with scen.Scenario(REPLAYED_YAML_CONTENT) as scenario:
+            # bound before the replay connects
+            scenario.build()
+            report = recording.replay(self._path, speed=0)
+            assert_equal(2, report["sent"])
+            assert_equal(0, report["skipped"])
+            scenario.step_all()
+
+    def test_invalid(self):
+        with open(self._path, "wb") as invalid:
+            invalid.write(b"not a recording")
+        with self.assertRaises(Exception):
+            list(recording.read(self._path))
+        recorder = recording.Recorder(self._path)
+        recorder.close()
+        with open(self._path, "ab") as truncated:
+            truncated.write(recording.RECORD.pack(100, recording.KIND_FRAME))
+        with self.assertRaises(Exception):
+            list(recording.read(self._path))
@@ -0,0 +1,81 @@
+from nose.tools import assert_equal
+import time
+import unittest
+import orwell.shooter.retention as retention
+
+
+class CaptureHistoryTest(unittest.TestCase):
+    @staticmethod
+    def _assert_not_retained(history, index):
+        try:
+            history[index]
+            thrown = False
+        except IndexError as exception:
+            thrown = ("not retained" in str(exception))
+        assert thrown, index
+
+    @staticmethod
+    def test_all():
+        history = retention.CaptureHistory()
+        for value in range(10):
+            history.append(value)
+        assert_equal(10, len(history))
+        assert_equal(list(range(10)), list(history))
+        assert_equal(3, history[3])
+        assert_equal([8, 9], history[-2:])
+
+    @staticmethod
+    def test_first_and_last():
+        history = retention.CaptureHistory(first=2, last=3)
+        for value in range(10):
+            history.append(value)
+        assert_equal(10, len(history))
+        assert_equal([0, 1, 7, 8, 9], list(history))
+        assert_equal(1, history[1])
+        assert_equal(7, history[-3])
+        assert_equal(9, history[9])
+        CaptureHistoryTest._assert_not_retained(history, 2)
+        CaptureHistoryTest._assert_not_retained(history, -4)
+
+    @staticmethod
+    def test_nothing():
+        history = retention.CaptureHistory(last=0)
+        history.append("value")
+        assert_equal(1, len(history))
+        CaptureHistoryTest._assert_not_retained(history, -1)
+
+    @staticmethod
+    def test_seconds():
+        history = retention.CaptureHistory(seconds=0.05)
+        history.append("old")
+        time.sleep(0.1)
+        history.append("new")
+        assert_equal(2, len(history))
+        assert_equal(["new"], list(history))
+        CaptureHistoryTest._assert_not_retained(history, 0)
+
+
+class RetentionTest(unittest.TestCase):
+    @staticmethod
+    def test_policies():
+        policies = retention.Retention(
+            {"Hello": 5,
+             "Ping": {"seconds": 2},
+             "default": "referenced"})
+        assert_equal(5, policies.policy("Hello").last)
+        assert_equal(2, policies.policy("Ping").seconds)
+        assert(policies.policy("Pong").referenced)
+        policies = retention.Retention({"last": 3, "seconds": 1})
+        assert_equal(3, policies.policy("Hello").last)
+        assert_equal(1, policies.policy("Hello").seconds)
+        assert(retention.Retention("all").policy("Hello") is retention.ALL)
+
+    @staticmethod
+    def test_invalid():
+        for value in ("some", -1, {"last": "many"}, {"Hello": "none"}):
+            try:
+                retention.Retention(value)
+                thrown = False
+            except Exception as exception:
+                thrown = ("Invalid retention" in str(exception))
+            assert thrown, value
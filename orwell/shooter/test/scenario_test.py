@@ -2,7 +2,11 @@ from nose.tools import assert_equal
 from nose.tools import assert_raises
 import unittest
 import orwell.shooter.scenario as scen
+import orwell.shooter.parallel as parallel
+import orwell.shooter.test.helpers as helpers
 import sys
+import tempfile
+import time
 
 
 class ScenarioTest(unittest.TestCase):
@@ -132,6 +136,746 @@ threads:
             sys.stderr.write("\n" + str(scenario._data) + "\n")
             scenario.build()
             scenario.step_all()
+            report = scenario.latency.report()
+            assert_equal(
+                ["fake client", "fake server"],
+                sorted(report["threads"].keys()))
+            assert_equal(
+                ["Hello->Welcome", "Ping->Pong", "Welcome->Ping"],
+                sorted(report["messages"].keys()))
+            assert_equal(1, report["messages"]["Ping->Pong"]["count"])
+
+    @staticmethod
+    def test_events():
+        print("test_events")
+        correct_id = "123"
+        yaml_content = ScenarioTest.yaml_content.replace(
+            "%welcome_id%", correct_id).replace(
+                "%expected_welcome_id%", correct_id).replace(
+                    "%logger%", "logger").replace(
+                        "%timestamp%", "1234")
+        with scen.Scenario(yaml_content, scheduler="events") as scenario:
+            scenario.build()
+            scenario.step_all()
+            assert(not scenario.has_more_steps)
+
+    @staticmethod
+    def test_asyncio():
+        print("test_asyncio")
+        correct_id = "123"
+        yaml_content = ScenarioTest.yaml_content.replace(
+            "%welcome_id%", correct_id).replace(
+                "%expected_welcome_id%", correct_id).replace(
+                    "%logger%", "logger").replace(
+                        "%timestamp%", "1234").replace(
+                            "9008", str(helpers.free_port())).replace(
+                                "9009", str(helpers.free_port()))
+        with scen.Scenario(yaml_content, scheduler="asyncio") as scenario:
+            scenario.build()
+            scenario.step_all()
+            assert(not scenario.has_more_steps)
+
+    @staticmethod
+    def test_asyncio_after_polling():
+        print("test_asyncio_after_polling")
+        yaml_content = ScenarioTest.yaml_content.replace(
+            "%welcome_id%", "123").replace(
+                "%expected_welcome_id%", "123").replace(
+                    "%logger%", "logger").replace(
+                        "%timestamp%", "1234").replace(
+                            "9008", str(helpers.free_port())).replace(
+                                "9009", str(helpers.free_port()))
+        # the sockets of the first scenario are closed with it
+        for scheduler in ("polling", "asyncio"):
+            with scen.Scenario(yaml_content, scheduler=scheduler) as scenario:
+                scenario.build()
+                scenario.step_all()
+                assert(not scenario.has_more_steps)
+
+    @staticmethod
+    def test_asyncio_failure():
+        print("test_asyncio_failure")
+        yaml_content = ScenarioTest.yaml_content.replace(
+            "%welcome_id%", "123").replace(
+                "%expected_welcome_id%", "666").replace(
+                    "%logger%", "logger").replace(
+                        "%timestamp%", "1234").replace(
+                            "9008", str(helpers.free_port())).replace(
+                                "9009", str(helpers.free_port()))
+        thrown = False
+        with scen.Scenario(yaml_content, scheduler="asyncio") as scenario:
+            scenario.build()
+            try:
+                scenario.step_all()
+            except Exception as received_exception:
+                expected = ("Failure at index 2 in thread 'fake client'.",)
+                thrown = (expected == received_exception.args)
+        assert(thrown)
+
+    @staticmethod
+    def test_processes():
+        print("test_processes")
+        yaml_content = ScenarioTest.yaml_content.replace(
+            "%welcome_id%", "123").replace(
+                "%expected_welcome_id%", "666").replace(
+                    "%logger%", "logger").replace(
+                        "%timestamp%", "1234").replace(
+                            "9008", str(helpers.free_port())).replace(
+                                "9009", str(helpers.free_port()))
+        thrown = False
+        with scen.Scenario(yaml_content, processes=2) as scenario:
+            scenario.build()
+            try:
+                scenario.step_all()
+            except Exception as received_exception:
+                expected = ("Failure at index 2 in thread 'fake client'.",)
+                thrown = (expected == received_exception.args)
+        assert(thrown)
+
+    @staticmethod
+    def test_partition():
+        print("test_partition")
+        yaml_content = ScenarioTest.yaml_content.replace(
+            "%welcome_id%", "123").replace(
+                "%expected_welcome_id%", "123").replace(
+                    "%logger%", "logger").replace(
+                        "%timestamp%", "1234")
+        scenario = scen.Scenario(yaml_content)
+        threads = scenario._threads
+        assert_equal([[0], [1]], parallel.partition(threads, 2))
+        assert_equal([[0, 1]], parallel.partition(threads, 1))
+        # sharing a bound socket forces the threads together
+        threads[1].in_socket = threads[0].in_socket
+        assert_equal([[0, 1]], parallel.partition(threads, 2))
+
+    @staticmethod
+    def test_inproc():
+        print("test_inproc")
+        yaml_content = helpers.portless(ScenarioTest.yaml_content.replace(
+            "%welcome_id%", "123").replace(
+                "%expected_welcome_id%", "123").replace(
+                    "%logger%", "logger").replace(
+                        "%timestamp%", "1234"))
+        for scheduler in ("polling", "events", "asyncio"):
+            with scen.Scenario(yaml_content, scheduler=scheduler) as scenario:
+                assert_equal(
+                    "inproc://endpoint_9008",
+                    scenario._threads[0].in_socket.connection_string)
+                scenario.build()
+                scenario.step_all()
+                assert(not scenario.has_more_steps)
+        # inproc endpoints only exist in one process
+        scenario = scen.Scenario(yaml_content)
+        assert_equal([[0, 1]], parallel.partition(scenario._threads, 2))
+
+    @staticmethod
+    def test_ipc():
+        print("test_ipc")
+        with tempfile.TemporaryDirectory() as directory:
+            yaml_content = helpers.portless(ScenarioTest.yaml_content.replace(
+                "%welcome_id%", "123").replace(
+                    "%expected_welcome_id%", "123").replace(
+                        "%logger%", "logger").replace(
+                            "%timestamp%", "1234"),
+                "ipc", directory + "/socket_")
+            with scen.Scenario(yaml_content) as scenario:
+                assert_equal(
+                    "ipc://" + directory + "/socket_9008",
+                    scenario._threads[0].in_socket.connection_string)
+                assert_equal(
+                    [[0], [1]], parallel.partition(scenario._threads, 2))
+                scenario.build()
+                scenario.step_all()
+                assert(not scenario.has_more_steps)
+
+    @staticmethod
+    def test_missing_address():
+        print("test_missing_address")
+        yaml_content = """
+messages: []
+
+sockets:
+    - !SocketPull &pull
+        protocol: inproc
+        bind: yes
+
+threads: []
+"""
+        scenario = scen.Scenario(yaml_content)
+        socket = scenario._data["sockets"][0]
+        with assert_raises(Exception) as context:
+            socket.connection_string
+        assert_equal(
+            ("Socket with protocol inproc needs an address.",),
+            context.exception.args)
+
+    @staticmethod
+    def test_replicas():
+        print("test_replicas")
+        yaml_content = """
+messages:
+    - hello: !CaptureHello &hello
+        destination: "{destination}"
+        message:
+            name: "{player_name}"
+            address: "{address}"
+
+sockets:
+    - !SocketPull &pull
+        port: 9011
+        bind: yes
+    - !SocketPush &push
+        port: 9011
+
+threads:
+    - !Thread
+        name: "robot"
+        replicas: 3
+        loop: False
+        in_socket: *pull
+        out_socket: *push
+        flow:
+            - !Out
+                message: *hello
+                arguments:
+                    destination: "{Replica.temporary_id}"
+                    player_name: "{Replica.robot_id}"
+                    address: "{Replica.index}"
+    - !Thread
+        name: "server"
+        loop: False
+        in_socket: *pull
+        out_socket: *push
+        flow:
+            - !In
+                message: *hello
+            - !In
+                message: *hello
+            - !In
+                message: *hello
+            - !Equal
+                values:
+                    - "3"
+                    - "{len(Hello)}"
+"""
+        with scen.Scenario(yaml_content) as scenario:
+            threads = scenario._threads
+            assert_equal(
+                ["robot#0", "robot#1", "robot#2", "server"],
+                [thread.name for thread in threads])
+            # bound sockets are shared, connected ones are not
+            assert(threads[0].in_socket is threads[1].in_socket)
+            assert(threads[0].out_socket is not threads[1].out_socket)
+            assert(threads[0].flow[0] is not threads[1].flow[0])
+            scenario.build()
+            scenario.step_all()
+            repository = scenario._threads[-1]._repository
+            received = [
+                repository.expand("{Hello[%i].player_name}" % index)
+                for index in range(3)]
+            assert_equal(["robot_0", "robot_1", "robot_2"], sorted(received))
+        for replicas in ("0", "-1", "1.5"):
+            with assert_raises(Exception) as raised:
+                scen.Scenario(yaml_content.replace(
+                    "replicas: 3", "replicas: " + replicas))
+            assert_equal(
+                ("Replicas must be a positive integer, not {}.".format(
+                    replicas),),
+                raised.exception.args)
+
+    @staticmethod
+    def test_destination_filter():
+        print("test_destination_filter")
+        yaml_content = """
+messages:
+    - hello: !CaptureHello &hello
+        destination: "{destination}"
+        message:
+            name: "{player_name}"
+
+sockets:
+    - !SocketPull &pull
+        port: 9012
+        bind: yes
+    - !SocketPush &push
+        port: 9012
+
+threads:
+    - !Thread
+        name: "filter"
+        loop: False
+        in_socket: *pull
+        out_socket: *push
+        flow:
+            - !Out
+                message: *hello
+                arguments:
+                    destination: "other"
+                    player_name: "first"
+            - !Out
+                message: *hello
+                arguments:
+                    destination: "me"
+                    player_name: "second"
+            - !In
+                message: *hello
+                destination: "me"
+            - !Equal
+                values:
+                    - "second"
+                    - "{Hello[-1].player_name}"
+            - !Equal
+                values:
+                    - "1"
+                    - "{len(Hello)}"
+"""
+        with scen.Scenario(yaml_content) as scenario:
+            scenario.build()
+            scenario.step_all()
+
+    @staticmethod
+    def test_exact():
+        print("test_exact")
+        yaml_content = """
+messages:
+    - hello: !CaptureHello &hello
+        destination: TEST1
+        message:
+            name: "{player_name}"
+            ready: "{ready}"
+    - ready_hello: !CaptureHello &ready_hello
+        destination: TEST1
+        message:
+            name: "{player_name}"
+            ready: True
+
+sockets:
+    - !SocketPull &pull
+        port: 9014
+        bind: yes
+    - !SocketPush &push
+        port: 9014
+
+threads:
+    - !Thread
+        name: "exact"
+        loop: False
+        in_socket: *pull
+        out_socket: *push
+        flow:
+            - !Out
+                message: *hello
+                arguments:
+                    player_name: "not ready"
+                    ready: False
+            - !Out
+                message: *hello
+                arguments:
+                    player_name: "ready"
+                    ready: True
+            - !In
+                message: *ready_hello
+                exact: True
+            - !Equal
+                values:
+                    - "ready"
+                    - "{Hello[-1].player_name}"
+            - !Equal
+                values:
+                    - "1"
+                    - "{len(Hello)}"
+"""
+        with scen.Scenario(yaml_content) as scenario:
+            scenario.build()
+            scenario.step_all()
+
+    @staticmethod
+    def test_unknown_name():
+        print("test_unknown_name")
+        yaml_content = """
+messages: []
+
+sockets:
+    - !SocketPull &pull
+        port: 9015
+        bind: yes
+    - !SocketPush &push
+        port: 9015
+
+threads:
+    - !Thread
+        name: "unknown name"
+        loop: False
+        in_socket: *pull
+        out_socket: *push
+        flow:
+            - !Equal
+                values:
+                    - "0"
+                    - "{len(Helo)}"
+"""
+        with scen.Scenario(yaml_content) as scenario:
+            try:
+                scenario.build()
+                thrown = False
+            except Exception as exception:
+                thrown = (
+                    ("Unknown name 'Helo' in expression '{len(Helo)}'.",)
+                    == exception.args)
+            assert(thrown)
+
+    @staticmethod
+    def test_out_rate():
+        print("test_out_rate")
+        yaml_content = """
+messages:
+    - hello: !CaptureHello &hello
+        destination: TEST1
+        message:
+            name: "{player_name}"
+
+sockets:
+    - !SocketPull &pull
+        port: 9013
+        bind: yes
+    - !SocketPush &push
+        port: 9013
+
+threads:
+    - !Thread
+        name: "sender"
+        loop: False
+        in_socket: *pull
+        out_socket: *push
+        flow:
+            - !OutRate
+                message: *hello
+                rate: 50
+                count: 5
+                arguments:
+                    player_name: "Player"
+            - !In
+                message: *hello
+            - !In
+                message: *hello
+            - !In
+                message: *hello
+            - !In
+                message: *hello
+            - !In
+                message: *hello
+"""
+        for scheduler in ("polling", "events"):
+            with scen.Scenario(yaml_content, scheduler=scheduler) as scenario:
+                scenario.build()
+                start = time.monotonic()
+                scenario.step_all()
+                # the last message is due 4 / 50 s after the first one
+                assert(time.monotonic() - start >= 0.08)
+                report = scenario._threads[0].flow[0].report
+                assert_equal(5, report["sent"])
+                assert(report["max_lag"] >= 0)
+
+    @staticmethod
+    def test_sleep_does_not_block():
+        print("test_sleep_does_not_block")
+        yaml_content = """
+messages:
+    - hello: !CaptureHello &hello
+        destination: TEST1
+        message:
+            name: "{player_name}"
+
+sockets:
+    - !SocketPull &pull
+        port: 9010
+        bind: yes
+    - !SocketPush &push
+        port: 9010
+
+threads:
+    - !Thread
+        name: "sleeper"
+        loop: False
+        in_socket: *pull
+        out_socket: *push
+        flow:
+            - !Sleep
+                seconds: 2
+    - !Thread
+        name: "talker"
+        loop: False
+        in_socket: *pull
+        out_socket: *push
+        flow:
+            - !Out
+                message: *hello
+                arguments:
+                    player_name: "Player"
+            - !In
+                message: *hello
+"""
+        for scheduler in ("polling", "events"):
+            with scen.Scenario(yaml_content, scheduler=scheduler) as scenario:
+                scenario.build()
+                sleeper, talker = scenario._threads
+                start = time.monotonic()
+                while talker.has_more_steps:
+                    scenario.step()
+                assert(time.monotonic() - start < 1)
+                assert(sleeper.has_more_steps)
+                assert(sleeper.deadline is not None)
+
+    SEND_POLICY_YAML = """
+io_threads: 2
+
+messages:
+    - hello: !CaptureHello &hello
+        destination: TEST1
+        message:
+            name: "Player"
+
+sockets:
+    - !SocketPull &pull
+        protocol: inproc
+        address: input
+        bind: yes
+    # nobody connects so a send can never be done right away
+    - !SocketPush &push
+        protocol: inproc
+        address: nobody
+        bind: yes
+        send_policy: %policy%
+        sndhwm: 10
+        rcvbuf: 4096
+        linger: 0
+
+threads:
+    - !Thread
+        name: "sender"
+        loop: False
+        in_socket: *pull
+        out_socket: *push
+        flow:
+            - !Out
+                message: *hello
+            - !OutRate
+                message: *hello
+                rate: 1000
+                count: 2
+"""
+
+    @staticmethod
+    def test_send_policy_drop():
+        print("test_send_policy_drop")
+        yaml_content = ScenarioTest.SEND_POLICY_YAML.replace(
+            "%policy%", "drop")
+        for scheduler in ("polling", "asyncio"):
+            with scen.Scenario(yaml_content, scheduler=scheduler) as scenario:
+                scenario.build()
+                zmq_socket = scenario._threads[0].out_socket.zmq_socket
+                assert_equal(10, zmq_socket.getsockopt(scen.zmq.SNDHWM))
+                assert_equal(4096, zmq_socket.getsockopt(scen.zmq.RCVBUF))
+                assert_equal(0, zmq_socket.getsockopt(scen.zmq.LINGER))
+                assert_equal(
+                    2,
+                    scenario._socket_pool.zmq_context.get(
+                        scen.zmq.IO_THREADS))
+                scenario.step_all()
+                assert_equal(
+                    {"inproc://nobody": {
+                        "sent": 0, "blocked": 0, "dropped": 3}},
+                    scenario.send_counts)
+
+    @staticmethod
+    def test_send_policy_fail():
+        print("test_send_policy_fail")
+        yaml_content = ScenarioTest.SEND_POLICY_YAML.replace(
+            "%policy%", "fail")
+        for scheduler in ("polling", "asyncio"):
+            with scen.Scenario(
+                    yaml_content,
+                    scheduler=scheduler,
+                    io_threads=1) as scenario:
+                assert_equal(
+                    1,
+                    scenario._socket_pool.zmq_context.get(
+                        scen.zmq.IO_THREADS))
+                scenario.build()
+                with assert_raises(Exception) as context:
+                    scenario.step_all()
+                assert_equal(
+                    ("Failure at index 0 in thread 'sender'.",),
+                    context.exception.args)
+        # the OutRate fails too
+        yaml_content = yaml_content.replace(
+            """            - !Out
+                message: *hello
+""", "")
+        with scen.Scenario(yaml_content) as scenario:
+            scenario.build()
+            with assert_raises(Exception) as context:
+                scenario.step_all()
+            assert_equal(
+                ("Failure at index 0 in thread 'sender'.",),
+                context.exception.args)
+            assert_equal(
+                0, scenario._threads[0].flow[0].report["sent"])
+
+    @staticmethod
+    def test_unknown_send_policy():
+        print("test_unknown_send_policy")
+        yaml_content = ScenarioTest.SEND_POLICY_YAML.replace(
+            "%policy%", "whatever")
+        with scen.Scenario(yaml_content) as scenario:
+            with assert_raises(Exception) as context:
+                scenario.build()
+            assert_equal(
+                ("Unknown send policy: 'whatever'",), context.exception.args)
+
+    SLO_YAML = """
+messages:
+    - hello: !CaptureHello &hello
+        destination: TEST1
+        message:
+            name: "Player"
+    - welcome: !CaptureWelcome &welcome
+        destination: "{id}"
+        message:
+            robot: Nono
+            team: One
+            id: "{id}"
+            video_address: "http://fake.com"
+            video_port: 42
+
+sockets:
+    - !SocketPull &pull_a
+        protocol: inproc
+        address: slo_a
+        bind: yes
+    - !SocketPull &pull_b
+        protocol: inproc
+        address: slo_b
+        bind: yes
+    - !SocketPush &push_a
+        protocol: inproc
+        address: slo_a
+    - !SocketPush &push_b
+        protocol: inproc
+        address: slo_b
+
+threads:
+    - !Thread
+        name: "server"
+        loop: False
+        in_socket: *pull_a
+        out_socket: *push_b
+        flow:
+            - !In
+                message: *hello
+            - !Sleep
+                seconds: %sleep%
+            - !Out
+                message: *welcome
+                arguments:
+                    id: 123
+    - !Thread
+        name: "client"
+        loop: False
+        in_socket: *pull_b
+        out_socket: *push_a
+        flow:
+            - !Out
+                message: *hello
+            - !In
+                message: *welcome
+                %wait%
+            - !Percentile
+                message: "%message%"
+                percentile: 99
+                below: %below%
+"""
+
+    @staticmethod
+    def _slo(sleep=0, wait="within: 1000", message="Hello->Welcome",
+             below=1000):
+        return ScenarioTest.SLO_YAML.replace(
+            "%sleep%", str(sleep)).replace(
+                "%wait%", wait).replace(
+                    "%message%", message).replace(
+                        "%below%", str(below))
+
+    @staticmethod
+    def _slo_failure(yaml_content, scheduler):
+        """Message of the failure of the scenario and its duration."""
+        start = time.monotonic()
+        with scen.Scenario(yaml_content, scheduler=scheduler) as scenario:
+            scenario.build()
+            with assert_raises(Exception) as context:
+                scenario.step_all()
+        return context.exception.args, time.monotonic() - start
+
+    @staticmethod
+    def test_slo():
+        print("test_slo")
+        for scheduler in scen.Scenario.SCHEDULERS:
+            for message in ("Hello->Welcome", "Welcome"):
+                with scen.Scenario(
+                        ScenarioTest._slo(message=message),
+                        scheduler=scheduler) as scenario:
+                    scenario.build()
+                    scenario.step_all()
+                    assert(not scenario.has_more_steps)
+
+    @staticmethod
+    def test_slo_within():
+        print("test_slo_within")
+        for scheduler in scen.Scenario.SCHEDULERS:
+            failure, seconds = ScenarioTest._slo_failure(
+                ScenarioTest._slo(sleep=2, wait="within: 100"), scheduler)
+            assert_equal(("Failure at index 1 in thread 'client'.",), failure)
+            # without waiting for the message
+            assert(seconds < 1)
+
+    @staticmethod
+    def test_slo_timeout():
+        print("test_slo_timeout")
+        for scheduler in scen.Scenario.SCHEDULERS:
+            failure, seconds = ScenarioTest._slo_failure(
+                ScenarioTest._slo(sleep=2, wait="timeout: 0.1"), scheduler)
+            assert_equal(("Failure at index 1 in thread 'client'.",), failure)
+            assert(seconds < 1)
+
+    @staticmethod
+    def test_slo_percentile():
+        print("test_slo_percentile")
+        for scheduler in scen.Scenario.SCHEDULERS:
+            for yaml_content in (
+                    ScenarioTest._slo(below=0.001),
+                    # nothing measured
+                    ScenarioTest._slo(message="Welcome->Hello")):
+                failure, _ = ScenarioTest._slo_failure(
+                    yaml_content, scheduler)
+                assert_equal(
+                    ("Failure at index 2 in thread 'client'.",), failure)
+        with assert_raises(Exception) as context:
+            with scen.Scenario(ScenarioTest._slo().replace(
+                    "percentile: 99", "percentile: 0")) as scenario:
+                scenario.build()
+        assert_equal(
+            ("Percentile must be in ]0, 100], not 0.",),
+            context.exception.args)
+
+    @staticmethod
+    def test_unknown_scheduler():
+        print("test_unknown_scheduler")
+        try:
+            scen.Scenario("threads: []", scheduler="whatever")
+            thrown = False
+        except Exception as expected_exception:
+            thrown = (
+                ("Unknown scheduler: 'whatever'",) == expected_exception.args)
+        assert(thrown)
 
     @staticmethod
     def test_2():
@@ -231,6 +975,49 @@ class CaptureRepositoryTest(unittest.TestCase):
             repo, "{Register[0].name}", name)
 
 
+    @staticmethod
+    def test_referenced():
+        repo = scen.CaptureRepository()
+        first = repo.compile("{Register[0].name}")
+        last = repo.compile("{Register[-1].name}")
+        count = repo.compile("{len(Register)}")
+        repo.set_retention("referenced")
+        for index in range(10):
+            repo.add_received_message(
+                FakeMessage("Register", [{"name": str(index)}], "dest"))
+        assert_equal("0", repo.evaluate(first))
+        assert_equal("9", repo.evaluate(last))
+        assert_equal("10", repo.evaluate(count))
+        assert_equal(
+            ["0", "9"],
+            [capture.name for capture in
+             repo._values_from_received_messages["Register"]])
+        CaptureRepositoryTest._check(
+            repo, "{Register[5].name}",
+            IndexError("message 5 of 10 was not retained"))
+
+    @staticmethod
+    def test_records():
+        repo = scen.CaptureRepository()
+        name = repo.compile("{Register[-1].name}")
+        repo.set_retention("referenced")
+        repo.add_received_message(
+            FakeMessage(
+                "Register",
+                [{"name": "NONO", "identifier": "ID42"}],
+                "dest",
+                raw="raw message"))
+        assert_equal("NONO", repo.evaluate(name))
+        record = repo._values_from_received_messages["Register"][-1]
+        assert(isinstance(record, scen.CaptureRecord))
+        assert(not hasattr(record, "__dict__"))
+        for attribute in ("identifier", "destination", "raw"):
+            CaptureRepositoryTest._check(
+                repo, "{Register[-1].%s}" % attribute,
+                AttributeError(
+                    "'CaptureConverter' object has no attribute '%s'"
+                    % attribute))
+
 def main():
     # ScenarioTest.test_1()
     ScenarioTest.test_2()
@@ -237,6 +237,174 @@ class CaptureTest(unittest.TestCase):
             expected = Exception("Invalid message type: " + fake_message_type)
             assert_equal(repr(expected), repr(exception))
 
+    @staticmethod
+    def test_message_types():
+        entry = y2p.get_message_type("Hello")
+        assert_equal("Hello", entry.name)
+        assert_equal(pb_controller.Hello, entry.protobuf_class)
+        assert_equal(y2p.CaptureHello, entry.capture_class)
+        assert_equal(pb_controller.Hello.DESCRIPTOR, entry.descriptor)
+        assert_equal(None, y2p.get_message_type("FakeMessageType"))
+
+    @staticmethod
+    def test_register_message_type():
+        class CaptureOtherHello(yaml.YAMLObject, y2p.Capture):
+            PROTOBUF_CLASS = pb_controller.Hello
+            yaml_tag = u'!CaptureOtherHello'
+            message_type = 'OtherHello'
+
+        y2p.register_message_type(CaptureOtherHello)
+        try:
+            payload = pb_controller.Hello(name="other").SerializeToString()
+            capture = y2p.Capture.create_from_zmq(b"dest OtherHello " + payload)
+            assert(isinstance(capture, CaptureOtherHello))
+            assert_equal("other", capture.protobuf_message.name)
+        finally:
+            del y2p.MESSAGE_TYPES["OtherHello"]
+
+    @staticmethod
+    def test_encoding_plan():
+        yaml_content = """
+constant: !CaptureInput
+    destination: TEST1
+    message:
+        move:
+            left: 0.5
+            right: -0.5
+        fire:
+            weapon1: False
+            weapon2: True
+variable: !CaptureInput
+    destination: "{destination}"
+    message:
+        move:
+            left: 0.5
+            right: "{right}"
+        fire:
+            weapon1: False
+            weapon2: True
+"""
+        data = yaml.load(yaml_content, Loader=yaml.FullLoader)
+        constant = data["constant"]
+        assert(constant.encoding_plan.constant)
+        frame = constant.encode_zmq_message({})
+        assert(frame is constant.encode_zmq_message({}))
+        variable = data["variable"]
+        assert(not variable.encoding_plan.constant)
+        dico = {"destination": "TEST2", "right": "0.25"}
+        capture = y2p.Capture.create_from_zmq(
+            variable.encode_zmq_message(dico))
+        assert_equal("TEST2", capture.destination)
+        assert_equal(variable.fill(dico), capture.protobuf_message)
+
+    @staticmethod
+    def test_encoding_plan_missing_required():
+        yaml_content = """
+message: !CaptureGameState
+    destination: TEST1
+    message:
+        seconds: "{seconds}"
+"""
+        data = yaml.load(yaml_content, Loader=yaml.FullLoader)
+        message = data["message"]
+        try:
+            message.encode_zmq_message({"seconds": 3})
+            thrown = False
+        except Exception as exception:
+            thrown = ("playing" in str(exception))
+        assert(thrown)
+
+    @staticmethod
+    def test_matcher():
+        yaml_content = """
+message: !CaptureGameState
+    destination: TEST1
+    message:
+        playing: True
+        teams:
+            - name: "{first}"
+              score: 2
+            - name: "{second}"
+              score: 1
+"""
+        data = yaml.load(yaml_content, Loader=yaml.FullLoader)
+        template = data["message"]
+        pb_message = pb_server_game.GameState()
+        pb_message.playing = True
+        for name, score in (("blue", 2), ("red", 3)):
+            team = pb_message.teams.add()
+            team.name = name
+            team.score = score
+        differences = []
+        captured = {}
+        assert(template.matcher.match(pb_message, differences, captured))
+        assert_equal([("/teams/1/score", 1, 3)], differences)
+        assert_equal({"first": "blue", "second": "red"}, captured)
+        differences = []
+        captured = {}
+        assert(not template.matcher.match(
+            pb_message, differences, captured, exact=True))
+        assert_equal([("/teams/1/score", 1, 3)], differences)
+        del pb_message.teams[1]
+        pb_message.playing = False
+        differences = []
+        captured = {}
+        assert(not template.matcher.match(
+            pb_message, differences, captured, exact=True))
+        # stops at the first difference
+        assert_equal([("/playing", True, False)], differences)
+        assert_equal({}, captured)
+
+    @staticmethod
+    def test_matcher_defaults():
+        yaml_content = """
+expected: !CaptureHello
+    destination: TEST1
+    message:
+        name: "{name}"
+        ready: True
+captured: !CaptureHello
+    destination: TEST1
+    message:
+        name: "{name}"
+        ready: "{ready}"
+"""
+        data = yaml.load(yaml_content, Loader=yaml.FullLoader)
+        # ready is not set but defaults to true
+        pb_message = pb_controller.Hello(name="bob")
+        differences = []
+        captured = {}
+        assert(data["expected"].matcher.match(
+            pb_message, differences, captured, exact=True))
+        assert_equal([], differences)
+        assert_equal({"name": "bob"}, captured)
+        differences = []
+        captured = {}
+        assert(data["captured"].matcher.match(
+            pb_message, differences, captured))
+        assert_equal({"name": "bob", "ready": True}, captured)
+        assert_equal(pb2dict(pb_message)["ready"], captured["ready"])
+
+    @staticmethod
+    def test_split_header():
+        destination, message_type, payload = y2p.split_header(
+            b"TEST1 Hello payload with spaces")
+        assert_equal("TEST1", destination)
+        assert_equal("Hello", message_type)
+        assert_equal(b"payload with spaces", bytes(payload))
+        long_destination = "x" * (y2p.HEADER_PEEK + 10)
+        destination, message_type, payload = y2p.split_header(
+            memoryview((long_destination + " Hello ").encode("utf8")))
+        assert_equal(long_destination, destination)
+        assert_equal("Hello", message_type)
+        assert_equal(b"", bytes(payload))
+        try:
+            y2p.split_header(b"TEST1")
+            thrown = False
+        except Exception as exception:
+            thrown = ("Invalid message header" in str(exception))
+        assert(thrown)
+
     @staticmethod
     def test_create_from_zmq_with_list():
         destination = "fake_id"
@@ -281,8 +449,30 @@ message: !CaptureGameState
         assert_equal(pb_message.teams[1].players[1], winner_robot_two)
 
 
-def test_generate():
-    y2p.generate()
+def test_lazy_classes():
+    assert(y2p.CaptureGoodbye is y2p.CaptureGoodbye)
+    assert_equal(u'!CaptureGoodbye', y2p.CaptureGoodbye.yaml_tag)
+    assert_equal(pb_server_game.Goodbye, y2p.Goodbye.PROTOBUF_CLASS)
+    assert_equal(
+        y2p.CaptureGoodbye, y2p.get_message_type("Goodbye").capture_class)
+    data = yaml.load("""
+message: !CaptureStop
+    destination: TEST1
+    message: {}
+""", Loader=yaml.FullLoader)
+    assert(isinstance(data["message"], y2p.CaptureStop))
+    try:
+        y2p.NotAMessage
+        thrown = False
+    except AttributeError:
+        thrown = True
+    assert(thrown)
+    try:
+        yaml.load("message: !CaptureNotAMessage {}", Loader=yaml.FullLoader)
+        thrown = False
+    except yaml.constructor.ConstructorError as exception:
+        thrown = ("!CaptureNotAMessage" in str(exception))
+    assert(thrown)
 
 
 def main():
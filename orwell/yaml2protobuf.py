@@ -1,45 +1,13 @@
 import re
-import sys
-import inspect
+import importlib
 import logging
 
 import yaml
 from pbjson.pbjson import pb2dict
 from pbjson.pbjson import dict2pb
 
-import orwell.messages.controller_pb2
-import orwell.messages.robot_pb2
-import orwell.messages.server_game_pb2
-import orwell.messages.server_web_pb2
-
 import google.protobuf.descriptor as pb_descriptor
-
-
-# adapted from http://stackoverflow.com/a/12144823/3552528
-class CustomMetaClass(type):
-
-    def __new__(cls, name, bases, members):
-        #collect up the metaclasses
-        metas = [type(base) for base in bases]
-
-        # prune repeated or conflicting entries
-        metas = [meta for index, meta in enumerate(metas)
-                 if not [later for later in metas[index+1:]
-                         if issubclass(later, meta)]]
-
-        # whip up the actual combined meta class derive off all of these
-        meta = type(name, tuple(metas), dict(combined_metas=metas))
-
-        # the member is added here because the constructor does not get
-        # called when the objects are constructed from yaml.
-        members['message'] = {}
-
-        # make the actual object
-        return meta(name, bases, members)
-
-    def __init__(self, name, bases, members):
-        for meta in self.combined_metas:
-            meta.__init__(self, name, bases, members)
+import google.protobuf.message as pb_message_module
 
 
 class Base(object):
@@ -115,7 +83,33 @@ class Base(object):
 
 
 from collections import namedtuple
-Comparison = namedtuple('Comparison', 'key reference_value compared')
+
+# the header (destination and message type) is looked for in this many
+# bytes first
+HEADER_PEEK = 256
+
+
+def split_header(zmq_message):
+    """Split a zmq message into destination, message type and payload.
+
+    zmq_message can be bytes or any buffer (like a zmq.Frame received with
+    copy=False). Only the header is copied: the payload is returned as a
+    memoryview so that it costs nothing if the message is discarded.
+    """
+    view = memoryview(zmq_message)
+    head = bytes(view[:HEADER_PEEK])
+    first = head.find(b' ')
+    second = head.find(b' ', first + 1) if (first >= 0) else -1
+    if (second < 0) and (len(view) > HEADER_PEEK):
+        head = bytes(view)
+        first = head.find(b' ')
+        second = head.find(b' ', first + 1) if (first >= 0) else -1
+    if (second < 0):
+        raise Exception("Invalid message header: " + repr(head[:64]))
+    return (
+        head[:first].decode("utf8"),
+        head[first + 1:second].decode("utf8"),
+        view[second + 1:])
 
 
 class Capture(object):
@@ -125,6 +119,8 @@ class Capture(object):
             setattr(instance, 'arguments', {})
         setattr(instance, 'captured', [])
         setattr(instance, '_pb_message', None)
+        setattr(instance, '_encoding_plan', None)
+        setattr(instance, '_matcher', None)
         # !CaptureMessage -> !Message
         setattr(
             instance,
@@ -134,30 +130,23 @@ class Capture(object):
 
     @staticmethod
     def create_from_zmq(zmq_message):
-        destination, message_type, payload = zmq_message.split(b' ', 2)
-        message_type = message_type.decode("utf8")
-        destination = destination.decode("utf8")
-        found = False
-        for module in (
-                orwell.messages.controller_pb2,
-                orwell.messages.robot_pb2,
-                orwell.messages.server_game_pb2,
-                orwell.messages.server_web_pb2):
-            if hasattr(module, message_type):
-                pb_klass = getattr(module, message_type)
-                found = True
-                break
-        if not found:
+        return Capture.decode(*split_header(zmq_message))
+
+    @staticmethod
+    def decode(destination, message_type, payload):
+        """Build a capture from a header already split by split_header."""
+        entry = get_message_type(message_type)
+        if entry is None:
             raise Exception("Invalid message type: " + message_type)
-        pb_message = pb_klass()
+        pb_message = entry.protobuf_class()
         pb_message.ParseFromString(payload)
-        klass = getattr(sys.modules[__name__], "Capture" + message_type)
-        capture = klass()
+        capture = entry.capture_class()
         capture._pb_message = pb_message
         capture.destination = destination
-        capture.message = pb2dict(pb_message)
+        # capture.message is only converted when needed (see __getattr__)
         logger = logging.getLogger(__name__)
-        logger.debug("capture.message = " + str(capture.message))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("capture.message = %s", capture.message)
         return capture
 
     @property
@@ -195,24 +184,35 @@ class Capture(object):
                     first = False
         return self._key_map
 
+    @property
+    def encoding_plan(self):
+        """EncodingPlan of the template (compiled on first access)."""
+        if self._encoding_plan is None:
+            self._encoding_plan = EncodingPlan(self)
+        return self._encoding_plan
+
     def encode_zmq_message(self, dico):
-        if (('{' == self.destination[0]) and ('}' == self.destination[-1])):
-            destination = self.destination.format(**dico)
-        else:
-            destination = self.destination
-        destination = destination.encode("utf8")
-        message_type = self.PROTOBUF_CLASS.DESCRIPTOR.name.encode("utf8")
-        return b" ".join((
-            destination,
-            message_type,
-            self.fill(dico).SerializeToString()))
+        return self.encoding_plan.encode(dico)
+
+    @property
+    def matcher(self):
+        """Matcher of the template (compiled on first access)."""
+        if self._matcher is None:
+            self._matcher = Matcher(
+                self.message, self.PROTOBUF_CLASS.DESCRIPTOR)
+        return self._matcher
 
     def __getitem__(self, index):
         return self.captured[index]
 
     def __getattr__(self, attribute):
         if "message" == attribute:
-            raise AttributeError
+            pb_message = self.__dict__.get("_pb_message")
+            if pb_message is None:
+                raise AttributeError
+            # received message: only converted when someone asks for it
+            self.message = pb2dict(pb_message)
+            return self.message
         if (hasattr(self, "message")):
             message = object.__getattribute__(self, "message")
             if ("message" == attribute):
@@ -225,7 +225,12 @@ class Capture(object):
         else:
             return object.__getattr__(self, attribute)
 
-    def compute_differences(self, other):
+    def compute_differences(self, other, exact=False):
+        """List the differences with other and capture its values.
+
+        If exact is True the comparison stops at the first difference (the
+        captured values are then incomplete).
+        """
         differences = []
         captured = {}
         if self.yaml_tag != other.yaml_tag:
@@ -234,57 +239,14 @@ class Capture(object):
         if self.destination != other.destination:
             differences.append(
                 ("@destination", self.destination, other.destination))
-
-        comparisons = []
-        for key, reference_value in self.key_map.items():
-            comparison = Comparison(key, reference_value, other.key_map)
-            comparisons.append(comparison)
-
+        if not (exact and differences):
+            self.matcher.match(
+                other.protobuf_message, differences, captured, exact)
+        # only the last capture is needed (the repository keeps the values)
+        self.captured = [captured]
         logger = logging.getLogger(__name__)
-        while (comparisons):
-            comparison = comparisons.pop(0)
-            key = comparison.key
-            reference_value = comparison.reference_value
-            compared = comparison.compared
-            logger.debug(
-                "compute_differences - key = '{key}'"
-                ", value = '{value}' "
-                "; compared = '{compared}'".format(
-                    key=key, value=reference_value, compared=compared))
-            try:
-                other_value = compared[key]
-                if isinstance(reference_value, dict):
-                    for sub_key, sub_value in reference_value.items():
-                        comparisons.append(
-                            Comparison(sub_key, sub_value, other_value))
-                    continue
-                elif isinstance(reference_value, list):
-                    for sub, sub_other in zip(reference_value, other_value):
-                        for sub_key, sub_value in sub.items():
-                            comparisons.append(
-                                Comparison(sub_key, sub_value, sub_other))
-                    continue
-            except:
-                other_value = None
-            logger.debug(
-                    "compute_differences - key = '{key}'"
-                    ", value = '{value}' "
-                    "; other.key_map[key] = '{other_value}'".format(
-                        key=key,
-                        value=reference_value,
-                        other_value=other_value))
-            if reference_value != other_value:
-                if ((isinstance(reference_value, str)) and
-                        (Base.CAPTURE_PATTERN.match(reference_value))):
-                    capture_name = reference_value[1:-1]
-                    captured[capture_name] = other_value
-                else:
-                    differences.append((key, reference_value, other_value))
-        self.captured.append(captured)
-        logger.debug("self")
-        logger.debug(self)
-        logger.debug("self.captured")
-        logger.debug(self.captured)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("self.captured = %s", self.captured)
         return differences
 
     def _compute_bool(self, value):
@@ -418,7 +380,7 @@ class Capture(object):
     def fill(self, dico):
         expanded_dico = {}
         logger = logging.getLogger(__name__)
-        logger.debug("++ self.message %s\n" % (self.message))
+        logger.debug("++ self.message %s", self.message)
         self._fill(
             dico,
             self.message,
@@ -427,423 +389,346 @@ class Capture(object):
         return dict2pb(self.PROTOBUF_CLASS, expanded_dico)
 
 
-def get_classes_from_module(module):
-    """ Extract module and name of classes.
-
-    Simple version that does not deal with classes nested in other classes.
-    """
-    classes_and_modules = []
-    class_descriptions = inspect.getmembers(module, inspect.isclass)
-    # cutting the end allows to find classes in the common_pb2 module
-    # this is quite ugly compared to the python2 version where
-    # klass.__module__ containted the full module
-    module_head = module.__name__[:module.__name__.rfind(".") + 1]
-    for class_description in class_descriptions:
-        name, klass = class_description
-        classes_and_modules.append((name, module_head + klass.__module__))
-    return classes_and_modules
-
-
-def configure_logging(verbose):
-    logger = logging.getLogger(__name__)
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-            '%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    if verbose:
-        logger.setLevel(logging.DEBUG)
-    else:
-        logger.setLevel(logging.INFO)
-
-
-def generate():
-    """Used to generate code with cog."""
-    import orwell.messages.controller_pb2 as pb_controller
-    import orwell.messages.robot_pb2 as pb_robot
-    import orwell.messages.server_game_pb2 as pb_server_game
-    import orwell.messages.server_web_pb2 as pb_server_web
-
-    TEMPLATE = """
-class {name}(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = {module}.{name}
-    yaml_tag = u'!{name}'
-
-
-class Capture{name}(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = {module}.{name}
-    yaml_tag = u'!Capture{name}'
-    message_type = '{name}'
-
-"""
-    output = ""
-
-    output += "\n"
-    array = get_classes_from_module(pb_controller)
-    array += get_classes_from_module(pb_robot)
-    array += get_classes_from_module(pb_server_game)
-    array += get_classes_from_module(pb_server_web)
-    for class_name, module_name in array:
-        output += TEMPLATE.format(name=class_name, module=module_name)
-    return output
-
-
-# use to generate the code with cog
-# cog.py -r orwell/yaml2protobuf.py
-# You may have to remove some classes before generating (you can remove
-# all of them as they will be generated again).
-COG_GENERATOR = """ [[[cog
-import os
-import sys
-import inspect
-full_path = os.path.abspath(inspect.getfile(inspect.currentframe()))
-plus_index = full_path.rfind('+')
-real_path = full_path[:plus_index]
-print('exec(%s)' % real_path)
-exec(open(real_path, 'r').read())
-import cog
-cog.outl(generate())
-# ]]] """
-
-
-class Fire(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.controller_pb2.Fire
-    yaml_tag = u'!Fire'
-
-
-class CaptureFire(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.controller_pb2.Fire
-    yaml_tag = u'!CaptureFire'
-    message_type = 'Fire'
-
-
-class Hello(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.controller_pb2.Hello
-    yaml_tag = u'!Hello'
-
-
-class CaptureHello(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.controller_pb2.Hello
-    yaml_tag = u'!CaptureHello'
-    message_type = 'Hello'
-
-
-class Input(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.controller_pb2.Input
-    yaml_tag = u'!Input'
-
-
-class CaptureInput(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.controller_pb2.Input
-    yaml_tag = u'!CaptureInput'
-    message_type = 'Input'
-
-
-class Move(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.controller_pb2.Move
-    yaml_tag = u'!Move'
-
-
-class CaptureMove(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.controller_pb2.Move
-    yaml_tag = u'!CaptureMove'
-    message_type = 'Move'
-
-
-class Ping(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.controller_pb2.Ping
-    yaml_tag = u'!Ping'
-
-
-class CapturePing(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.controller_pb2.Ping
-    yaml_tag = u'!CapturePing'
-    message_type = 'Ping'
-
-
-class Colour(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.robot_pb2.Colour
-    yaml_tag = u'!Colour'
-
-
-class CaptureColour(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.robot_pb2.Colour
-    yaml_tag = u'!CaptureColour'
-    message_type = 'Colour'
-
-
-class Pong(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.robot_pb2.Pong
-    yaml_tag = u'!Pong'
-
-
-class CapturePong(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.robot_pb2.Pong
-    yaml_tag = u'!CapturePong'
-    message_type = 'Pong'
-
-
-class Register(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.robot_pb2.Register
-    yaml_tag = u'!Register'
-
-
-class CaptureRegister(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.robot_pb2.Register
-    yaml_tag = u'!CaptureRegister'
-    message_type = 'Register'
-
-
-class Rfid(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.robot_pb2.Rfid
-    yaml_tag = u'!Rfid'
-
+def _has_placeholder(value):
+    """Tell if filling value may change it (str.format is applied to
+    strings)."""
+    if isinstance(value, str):
+        return ('{' in value) or ('}' in value)
+    elif isinstance(value, dict):
+        return any(_has_placeholder(sub) for sub in value.values())
+    elif isinstance(value, list):
+        return any(_has_placeholder(sub) for sub in value)
+    return False
 
-class CaptureRfid(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.robot_pb2.Rfid
-    yaml_tag = u'!CaptureRfid'
-    message_type = 'Rfid'
 
+_MATCH_VALUE, _MATCH_CAPTURE, _MATCH_MESSAGE, _MATCH_LIST = range(4)
 
-class ServerRobotState(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.robot_pb2.ServerRobotState
-    yaml_tag = u'!ServerRobotState'
 
+def _field_value(message, field):
+    """Value of field in message or None if the field is not set.
 
-class CaptureServerRobotState(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.robot_pb2.ServerRobotState
-    yaml_tag = u'!CaptureServerRobotState'
-    message_type = 'ServerRobotState'
-
-
-class Access(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Access
-    yaml_tag = u'!Access'
-
-
-class CaptureAccess(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Access
-    yaml_tag = u'!CaptureAccess'
-    message_type = 'Access'
-
-
-class Battery(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.common_pb2.Battery
-    yaml_tag = u'!Battery'
-
-
-class CaptureBattery(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.common_pb2.Battery
-    yaml_tag = u'!CaptureBattery'
-    message_type = 'Battery'
-
-
-class Coordinates(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Coordinates
-    yaml_tag = u'!Coordinates'
-
-
-class CaptureCoordinates(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Coordinates
-    yaml_tag = u'!CaptureCoordinates'
-    message_type = 'Coordinates'
-
-
-class GameState(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.GameState
-    yaml_tag = u'!GameState'
-
-
-class CaptureGameState(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.GameState
-    yaml_tag = u'!CaptureGameState'
-    message_type = 'GameState'
-
-
-class Goodbye(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Goodbye
-    yaml_tag = u'!Goodbye'
-
-
-class CaptureGoodbye(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Goodbye
-    yaml_tag = u'!CaptureGoodbye'
-    message_type = 'Goodbye'
-
-
-class Item(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Item
-    yaml_tag = u'!Item'
-
-
-class CaptureItem(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Item
-    yaml_tag = u'!CaptureItem'
-    message_type = 'Item'
-
-
-class Landmark(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Landmark
-    yaml_tag = u'!Landmark'
-
-
-class CaptureLandmark(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Landmark
-    yaml_tag = u'!CaptureLandmark'
-    message_type = 'Landmark'
-
-
-class PlayerState(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.PlayerState
-    yaml_tag = u'!PlayerState'
-
-
-class CapturePlayerState(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.PlayerState
-    yaml_tag = u'!CapturePlayerState'
-    message_type = 'PlayerState'
-
-
-class RGBColour(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.RGBColour
-    yaml_tag = u'!RGBColour'
-
-
-class CaptureRGBColour(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.RGBColour
-    yaml_tag = u'!CaptureRGBColour'
-    message_type = 'RGBColour'
-
-
-class Registered(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Registered
-    yaml_tag = u'!Registered'
-
-
-class CaptureRegistered(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Registered
-    yaml_tag = u'!CaptureRegistered'
-    message_type = 'Registered'
-
-
-class Start(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Start
-    yaml_tag = u'!Start'
-
-
-class CaptureStart(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Start
-    yaml_tag = u'!CaptureStart'
-    message_type = 'Start'
-
-
-class Stop(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Stop
-    yaml_tag = u'!Stop'
-
-
-class CaptureStop(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Stop
-    yaml_tag = u'!CaptureStop'
-    message_type = 'Stop'
-
-
-class Team(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Team
-    yaml_tag = u'!Team'
-
-
-class CaptureTeam(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Team
-    yaml_tag = u'!CaptureTeam'
-    message_type = 'Team'
-
-
-class Timing(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.common_pb2.Timing
-    yaml_tag = u'!Timing'
-
-
-class CaptureTiming(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.common_pb2.Timing
-    yaml_tag = u'!CaptureTiming'
-    message_type = 'Timing'
+    An unset field with a declared default value reads as that value (like
+    in pb2dict).
+    """
+    if (message is None) or (field is None):
+        return None
+    if pb_descriptor.FieldDescriptor.LABEL_REPEATED == field.label:
+        return list(getattr(message, field.name))
+    try:
+        if not message.HasField(field.name):
+            if field.has_default_value:
+                return getattr(message, field.name)
+            return None
+    except ValueError:
+        # proto3 scalar without presence: the default value means not set
+        value = getattr(message, field.name)
+        return None if value == field.default_value else value
+    return getattr(message, field.name)
+
+
+def _to_python(value):
+    if isinstance(value, pb_message_module.Message):
+        return pb2dict(value)
+    if isinstance(value, list):
+        return [_to_python(item) for item in value]
+    return value
+
+
+class Matcher(object):
+    """Comparison of received messages with a Capture template prepared
+    once.
+
+    The template is compiled following the descriptor of the protobuf
+    message so that the received protobuf message is walked directly (no
+    conversion to a dictionary). Differences are reported with the path of
+    the field (like "/move/left" or "/teams/0/name") and the values of the
+    "{capture}" placeholders are extracted on the way.
+    """
 
+    def __init__(self, template, descriptor):
+        self._fields = []
+        for key, value in template.items():
+            field = descriptor.fields_by_name.get(key)
+            self._fields.append(
+                ("/" + key, field, Matcher._compile(value, field)))
 
-class Ultrasound(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.common_pb2.Ultrasound
-    yaml_tag = u'!Ultrasound'
+    @staticmethod
+    def _compile(value, field):
+        if isinstance(value, str) and Base.CAPTURE_PATTERN.match(value):
+            return (_MATCH_CAPTURE, value[1:-1])
+        is_message = ((field is not None) and
+                      (pb_descriptor.FieldDescriptor.TYPE_MESSAGE ==
+                       field.type))
+        if isinstance(value, dict) and is_message:
+            return (_MATCH_MESSAGE, Matcher(value, field.message_type))
+        if isinstance(value, list):
+            return (_MATCH_LIST,
+                    (value, [Matcher._compile(item, field) for item in value]))
+        return (_MATCH_VALUE, value)
+
+    def match(self, message, differences, captured, exact=False, path=""):
+        """Compare message with the template.
+
+        Differences are appended to differences and captured values set in
+        captured. Returns False if exact is True and a difference was found
+        (the comparison stops there).
+        """
+        for key, field, check in self._fields:
+            value = _field_value(message, field)
+            if not Matcher._match(
+                    path + key, value, check, differences, captured, exact):
+                return False
+        return True
 
+    @staticmethod
+    def _match(path, value, check, differences, captured, exact):
+        kind, expected = check
+        if _MATCH_CAPTURE == kind:
+            captured[expected] = _to_python(value)
+        elif _MATCH_MESSAGE == kind:
+            return expected.match(value, differences, captured, exact, path)
+        elif _MATCH_LIST == kind:
+            template, item_checks = expected
+            value = value or []
+            if len(template) != len(value):
+                differences.append((path, template, _to_python(value)))
+                if exact:
+                    return False
+            for index, (item_check, item) in enumerate(
+                    zip(item_checks, value)):
+                if not Matcher._match(
+                        "{}/{}".format(path, index),
+                        item,
+                        item_check,
+                        differences,
+                        captured,
+                        exact):
+                    return False
+        elif expected != value:
+            differences.append((path, expected, _to_python(value)))
+            if exact:
+                return False
+        return True
+
+
+class EncodingPlan(object):
+    """Encoding of a Capture template prepared once.
+
+    The top level fields without placeholders are converted and serialized
+    when the plan is built; for each message only the fields with
+    placeholders are filled. A protobuf parser merges the fields found in
+    the concatenation of two serialized messages so both parts are simply
+    joined. A template without any placeholder gives the same frame every
+    time.
+    """
 
-class CaptureUltrasound(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.common_pb2.Ultrasound
-    yaml_tag = u'!CaptureUltrasound'
-    message_type = 'Ultrasound'
+    def __init__(self, capture):
+        self._capture = capture
+        self._protobuf_class = capture.PROTOBUF_CLASS
+        self._descriptor = capture.PROTOBUF_CLASS.DESCRIPTOR
+        self._message_type = self._descriptor.name.encode("utf8")
+        destination = capture.destination
+        self._destination_template = None
+        if (('{' == destination[0]) and ('}' == destination[-1])):
+            self._destination_template = destination
+        else:
+            self._destination = destination.encode("utf8")
+        self._variable = {}
+        constant = {}
+        for key, value in capture.message.items():
+            if _has_placeholder(value):
+                self._variable[key] = value
+            else:
+                constant[key] = value
+        if self._variable:
+            # required fields go with the variable ones so that each part
+            # can be converted on its own
+            for field in self._descriptor.fields:
+                if ((pb_descriptor.FieldDescriptor.LABEL_REQUIRED ==
+                        field.label) and (field.name in constant)):
+                    self._variable[field.name] = constant.pop(field.name)
+        expanded_dico = {}
+        capture._fill({}, constant, expanded_dico, self._descriptor)
+        constant_message = dict2pb(self._protobuf_class, expanded_dico)
+        if self._variable:
+            self._constant_payload = (
+                constant_message.SerializePartialToString())
+            # the required fields are checked on the first full message
+            self._checked = False
+        else:
+            self._constant_payload = constant_message.SerializeToString()
+            self._checked = True
+        self._frame = None
+        if ((not self._variable) and
+                (self._destination_template is None)):
+            self._frame = b" ".join((
+                self._destination,
+                self._message_type,
+                self._constant_payload))
 
+    @property
+    def constant(self):
+        """True if all the messages encoded are identical."""
+        return self._frame is not None
+
+    def encode(self, dico):
+        if self._frame is not None:
+            return self._frame
+        if self._destination_template is not None:
+            destination = self._destination_template.format(
+                **dico).encode("utf8")
+        else:
+            destination = self._destination
+        payload = self._constant_payload
+        if self._variable:
+            expanded_dico = {}
+            self._capture._fill(
+                dico, self._variable, expanded_dico, self._descriptor)
+            payload += dict2pb(
+                self._protobuf_class,
+                expanded_dico).SerializePartialToString()
+            if not self._checked:
+                message = self._protobuf_class()
+                message.ParseFromString(payload)
+                # raises like the serialization of the full message would
+                message.SerializeToString()
+                self._checked = True
+        return b" ".join((destination, self._message_type, payload))
+
+
+MessageType = namedtuple(
+    'MessageType', 'name protobuf_class capture_class descriptor')
+
+# message type name -> MessageType (filled by register_message_type)
+MESSAGE_TYPES = {}
+
+
+def register_message_type(capture_class):
+    """Make a CaptureXXX class known to the decoding of received messages.
+
+    The name of the message type is taken from capture_class.message_type.
+    Registering a class for an existing name replaces the previous one.
+    """
+    entry = _message_type_entry(capture_class)
+    MESSAGE_TYPES[entry.name] = entry
+    return entry
 
-class Welcome(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Welcome
-    yaml_tag = u'!Welcome'
 
+def _message_type_entry(capture_class):
+    return MessageType(
+        capture_class.message_type,
+        capture_class.PROTOBUF_CLASS,
+        capture_class,
+        capture_class.PROTOBUF_CLASS.DESCRIPTOR)
 
-class CaptureWelcome(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_game_pb2.Welcome
-    yaml_tag = u'!CaptureWelcome'
-    message_type = 'Welcome'
 
+def get_message_type(name):
+    """Return the MessageType registered for name (None if unknown).
 
-class GetAccess(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_web_pb2.GetAccess
-    yaml_tag = u'!GetAccess'
+    The CaptureXXX classes of the protobuf messages are created when first
+    needed.
+    """
+    entry = MESSAGE_TYPES.get(name)
+    if entry is None:
+        _message_class("Capture" + name)
+        entry = MESSAGE_TYPES.get(name)
+    return entry
 
 
-class CaptureGetAccess(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_web_pb2.GetAccess
-    yaml_tag = u'!CaptureGetAccess'
-    message_type = 'GetAccess'
+# modules where the protobuf messages are looked for (the first definition of
+# a name wins)
+MESSAGE_MODULES = (
+    "orwell.messages.controller_pb2",
+    "orwell.messages.robot_pb2",
+    "orwell.messages.server_game_pb2",
+    "orwell.messages.server_web_pb2",
+    "orwell.messages.common_pb2",
+)
 
+# message name -> protobuf class (filled on first use)
+_PROTOBUF_CLASSES = {}
 
-class GetGameState(yaml.YAMLObject, Base):
-    __metaclass__ = CustomMetaClass
-    PROTOBUF_CLASS = orwell.messages.server_web_pb2.GetGameState
-    yaml_tag = u'!GetGameState'
 
+def _protobuf_class(name):
+    """Protobuf class of a message (None if unknown).
 
-class CaptureGetGameState(yaml.YAMLObject, Capture):
-    PROTOBUF_CLASS = orwell.messages.server_web_pb2.GetGameState
-    yaml_tag = u'!CaptureGetGameState'
-    message_type = 'GetGameState'
+    The modules of the messages are only imported when a message is first
+    needed.
+    """
+    if not _PROTOBUF_CLASSES:
+        for module_name in MESSAGE_MODULES:
+            module = importlib.import_module(module_name)
+            for message_name in module.DESCRIPTOR.message_types_by_name:
+                _PROTOBUF_CLASSES.setdefault(
+                    message_name, getattr(module, message_name))
+    return _PROTOBUF_CLASSES.get(name)
 
 
-# [[[end]]]
+def _message_class(class_name):
+    """Create (once) the class Xxx or CaptureXxx of the message Xxx.
 
-if "__main__" == __name__:
-    print(generate())
+    The classes are stored in the module so `yaml2protobuf.CaptureHello`
+    works (see __getattr__) and they can be pickled. None is returned if
+    there is no such message.
+    """
+    cls = globals().get(class_name)
+    if cls is not None:
+        if getattr(cls, "yaml_tag", None) == u'!' + class_name:
+            return cls
+        return None
+    if class_name.startswith("Capture"):
+        name = class_name[len("Capture"):]
+        base = Capture
+    else:
+        name = class_name
+        base = Base
+    protobuf_class = _protobuf_class(name)
+    if protobuf_class is None:
+        return None
+    members = {
+        "__module__": __name__,
+        "PROTOBUF_CLASS": protobuf_class,
+        "yaml_tag": u'!' + class_name,
+    }
+    if base is Capture:
+        members["message_type"] = name
+    # the metaclass registers the tag on the loaders
+    cls = yaml.YAMLObjectMetaclass(
+        class_name, (yaml.YAMLObject, base), members)
+    globals()[class_name] = cls
+    if base is Capture:
+        MESSAGE_TYPES.setdefault(name, _message_type_entry(cls))
+    return cls
+
+
+def __getattr__(attribute):
+    cls = None
+    if not attribute.startswith("_"):
+        cls = _message_class(attribute)
+    if cls is None:
+        raise AttributeError(
+            "module '{}' has no attribute '{}'".format(__name__, attribute))
+    return cls
+
+
+def _construct_message(loader, tag_suffix, node):
+    """Constructor of the !Xxx and !CaptureXxx tags not known yet."""
+    cls = _message_class(tag_suffix)
+    if cls is None:
+        raise yaml.constructor.ConstructorError(
+            None, None,
+            "could not determine a constructor for the tag '!{}'".format(
+                tag_suffix),
+            node.start_mark)
+    return cls.from_yaml(loader, node)
+
+
+def _add_multi_constructor():
+    loaders = yaml.YAMLObject.yaml_loader
+    if not isinstance(loaders, list):
+        loaders = [loaders]
+    for loader in loaders:
+        yaml.add_multi_constructor(u'!', _construct_message, Loader=loader)
+
+
+_add_multi_constructor()
@@ -35,6 +35,6 @@ setuptools.setup(
         'Operating System :: POSIX :: Linux',
         'Topic :: Utilities',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.6'],
-    python_requires='>=3.6.0',
+        'Programming Language :: Python :: 3.7'],
+    python_requires='>=3.7.0',
 )